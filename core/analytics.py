@@ -0,0 +1,148 @@
+import numpy as np
+import pandas as pd
+
+from core.artifacts import write_array_dir, read_array_dir
+
+class SegmentStore:
+    """
+    Precomputed analytics over the labeled RFM table, built once at training
+    time so the seller dashboard never touches per-customer rows on a rerun.
+
+    - Customer lookup: customer IDs sorted once, found with np.searchsorted
+      (O(log n)) against memory-mapped columns.
+    - Per-segment KPIs: customers, share, mean recency/frequency/monetary and
+      total spend, plus overall KPIs.
+    - Recency x monetary density: per-segment 2D histogram (linear recency,
+      log10 monetary) whose non-empty cells replace the per-customer scatter.
+    Everything served is bounded by the number of segments and bins, not customers.
+    """
+
+    ARTIFACT_KIND = "segment_store"
+    N_SAMPLE_IDS = 50
+
+    def __init__(self, customer_ids, recency, frequency, monetary, segment_codes, segments, density,
+                 recency_edges, monetary_edges, sample_ids, summary=None, kpis=None):
+        self.customer_ids = customer_ids
+        self.recency = recency
+        self.frequency = frequency
+        self.monetary = monetary
+        self.segment_codes = segment_codes
+        self.segments = list(segments)
+        self.density = density
+        self.recency_edges = recency_edges
+        self.monetary_edges = monetary_edges
+        self.sample_ids = sample_ids
+        if summary is None:
+            summary, kpis = self._summarize()
+        self.summary = summary
+        self.kpis = kpis
+
+    @classmethod
+    def build(cls, rfm, bins=60, seed=0):
+        """
+        Builds the store from a labeled RFM table (customerid, recency,
+        frequency, monetary, segment).
+        """
+        order = np.argsort(rfm['customerid'].to_numpy(), kind='stable')
+        codes, segments = pd.factorize(rfm['segment'].astype(str).to_numpy()[order], sort=True)
+        recency = rfm['recency'].to_numpy()[order]
+        monetary = rfm['monetary'].to_numpy()[order]
+
+        log_monetary = np.log10(np.maximum(monetary, 1))
+        recency_edges = np.linspace(0, max(recency.max(initial=0), 1), bins + 1)
+        monetary_edges = np.linspace(0, max(log_monetary.max(initial=0), 1), bins + 1)
+        density = np.zeros((len(segments), bins, bins), dtype=np.int64)
+        for code in range(len(segments)):
+            mask = codes == code
+            density[code] = np.histogram2d(recency[mask], log_monetary[mask], bins=[recency_edges, monetary_edges])[0]
+
+        customer_ids = rfm['customerid'].to_numpy()[order].astype(np.int64)
+        rng = np.random.default_rng(seed)
+        sample_ids = rng.choice(customer_ids, min(cls.N_SAMPLE_IDS, len(customer_ids)), replace=False)
+        return cls(customer_ids, recency, rfm['frequency'].to_numpy()[order], monetary, codes.astype(np.int16),
+                   segments, density, recency_edges, monetary_edges, sample_ids)
+
+    def _summarize(self):
+        """
+        Per-segment and overall KPIs (one pass over the customers, done at build time).
+        """
+        n = len(self.customer_ids)
+        counts = np.bincount(self.segment_codes, minlength=len(self.segments))
+        def segment_sum(values):
+            return np.bincount(self.segment_codes, weights=np.asarray(values, dtype=float), minlength=len(self.segments))
+        safe = np.maximum(counts, 1)
+        summary = pd.DataFrame({
+            'segment': self.segments,
+            'customers': counts,
+            'share': counts / max(n, 1),
+            'mean_recency': segment_sum(self.recency) / safe,
+            'mean_frequency': segment_sum(self.frequency) / safe,
+            'mean_monetary': segment_sum(self.monetary) / safe,
+            'total_monetary': segment_sum(self.monetary),
+        })
+        kpis = {
+            'customers': n,
+            'mean_monetary': float(np.mean(self.monetary)) if n else 0.0,
+            'mean_frequency': float(np.mean(self.frequency)) if n else 0.0,
+            'segments': int((counts > 0).sum()),
+        }
+        return summary, kpis
+
+    def __len__(self):
+        return len(self.customer_ids)
+
+    def lookup(self, customerid):
+        """
+        Profile of one customer (dict with recency, frequency, monetary and
+        segment), or None if the ID is unknown.
+        """
+        pos = int(np.searchsorted(self.customer_ids, customerid))
+        if pos >= len(self.customer_ids) or self.customer_ids[pos] != customerid:
+            return None
+        return {
+            'customerid': int(self.customer_ids[pos]),
+            'recency': int(self.recency[pos]),
+            'frequency': int(self.frequency[pos]),
+            'monetary': int(self.monetary[pos]),
+            'segment': self.segments[self.segment_codes[pos]],
+        }
+
+    def density_frame(self):
+        """
+        Non-empty cells of the recency x monetary histogram as rows of (segment,
+        recency, monetary, customers), with cell centres in data units.
+        """
+        seg, r, m = np.nonzero(self.density)
+        recency_mid = (self.recency_edges[:-1] + self.recency_edges[1:]) / 2
+        monetary_mid = 10 ** ((self.monetary_edges[:-1] + self.monetary_edges[1:]) / 2)
+        return pd.DataFrame({
+            'segment': np.asarray(self.segments, dtype=object)[seg],
+            'recency': recency_mid[r],
+            'monetary': monetary_mid[m],
+            'customers': self.density[seg, r, m],
+        })
+
+    def save(self, path):
+        arrays = {
+            'customer_ids': self.customer_ids, 'recency': self.recency, 'frequency': self.frequency,
+            'monetary': self.monetary, 'segment_codes': self.segment_codes, 'density': self.density,
+            'recency_edges': self.recency_edges, 'monetary_edges': self.monetary_edges, 'sample_ids': self.sample_ids,
+        }
+        for col in self.summary.columns[1:]:
+            arrays[f'summary_{col}'] = self.summary[col].to_numpy()
+        write_array_dir(path, self.ARTIFACT_KIND, arrays, {'segments': self.segments, 'kpis': self.kpis,
+                                                           'summary_columns': list(self.summary.columns)})
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """
+        Opens a store written by save(); per-customer columns are memory-mapped.
+        """
+        meta, arrays = read_array_dir(path, cls.ARTIFACT_KIND, mmap=mmap)
+        summary = pd.DataFrame({'segment': meta['segments']})
+        for col in meta['summary_columns'][1:]:
+            summary[col] = np.asarray(arrays[f'summary_{col}'])
+        return cls(arrays['customer_ids'], arrays['recency'], arrays['frequency'], arrays['monetary'],
+                   arrays['segment_codes'], meta['segments'], np.asarray(arrays['density']),
+                   np.asarray(arrays['recency_edges']), np.asarray(arrays['monetary_edges']),
+                   np.asarray(arrays['sample_ids']), summary, meta['kpis'])
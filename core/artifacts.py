@@ -0,0 +1,48 @@
+import numpy as np
+import json
+import os
+import shutil
+
+# Bump when the on-disk layout changes; loaders refuse other versions
+FORMAT_VERSION = 1
+
+def write_array_dir(path, kind, arrays, meta=None):
+    """
+    Writes a versioned binary artifact: one .npy file per array plus meta.json.
+    The directory is written next to the target and swapped in at the end, so
+    readers never see a half-written artifact.
+    """
+    tmp_path = path + ".tmp"
+    if os.path.exists(tmp_path):
+        shutil.rmtree(tmp_path)
+    os.makedirs(tmp_path)
+
+    for name, array in arrays.items():
+        np.save(os.path.join(tmp_path, f"{name}.npy"), np.ascontiguousarray(array), allow_pickle=False)
+    meta = dict(meta or {}, kind=kind, version=FORMAT_VERSION, arrays=sorted(arrays))
+    with open(os.path.join(tmp_path, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.replace(tmp_path, path)
+
+def read_array_dir(path, kind, mmap=True):
+    """
+    Opens an artifact written by write_array_dir. Arrays are memory-mapped
+    read-only by default, so opening costs no copying and pages are shared
+    between processes. Returns (meta, arrays).
+    """
+    meta_path = os.path.join(path, "meta.json")
+    if not os.path.exists(meta_path):
+        raise FileNotFoundError(f"No artifact found at {path}")
+    with open(meta_path, encoding="utf-8") as f:
+        meta = json.load(f)
+    if meta.get('kind') != kind or meta.get('version') != FORMAT_VERSION:
+        raise ValueError(f"{path} holds a '{meta.get('kind')}' v{meta.get('version')} artifact, "
+                         f"expected '{kind}' v{FORMAT_VERSION}; re-run training")
+
+    mmap_mode = "r" if mmap else None
+    arrays = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mmap_mode, allow_pickle=False)
+              for name in meta['arrays']}
+    return meta, arrays
@@ -0,0 +1,160 @@
+import bisect
+
+import numpy as np
+import pandas as pd
+
+from core.artifacts import write_array_dir, read_array_dir
+from core.recommendation import normalize_item
+
+def trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+class ProductCatalog:
+    """
+    Typeahead index over the product descriptions.
+
+    Products are keyed by their normalized name (see normalize_item) and
+    numbered by popularity (number of invoices containing them), so product 0
+    is the best seller and any list of ids sorted ascending is already ranked.
+    - prefix search: binary search over the normalized names in sorted order;
+    - substring search: an inverted index from trigram to the products
+      containing it; the postings of the query's trigrams are intersected and
+      the few survivors checked with a plain substring test.
+    `display` holds the name shown to users (the most frequent raw spelling,
+    stripped) and `normalized_of` maps it back to the key the recommender
+    matches on, so selections do not have to be normalized again per request.
+    """
+
+    ARTIFACT_KIND = "catalog"
+
+    def __init__(self, display, normalized, invoice_counts, trigram_keys, trigram_indptr, trigram_indices):
+        self.display = list(display)
+        self.normalized = list(normalized)
+        self.invoice_counts = np.asarray(invoice_counts)
+        self.trigram_ids = {t: i for i, t in enumerate(trigram_keys)}
+        self.trigram_indptr = np.asarray(trigram_indptr)
+        self.trigram_indices = np.asarray(trigram_indices)
+
+        self.by_name = np.array(sorted(range(len(self.normalized)), key=self.normalized.__getitem__), dtype=np.int64)
+        self.sorted_names = [self.normalized[i] for i in self.by_name.tolist()]
+        self.normalized_of = dict(zip(self.display, self.normalized))
+        self.id_of = {name: i for i, name in enumerate(self.normalized)}
+
+    @classmethod
+    def build(cls, df):
+        """
+        Builds the catalog from transaction lines (invoiceno, description).
+        """
+        lines = pd.DataFrame({
+            'invoiceno': df['invoiceno'].to_numpy(),
+            'raw': df['description'].astype(str).str.strip().to_numpy(),
+        })
+        lines['key'] = lines['raw'].str.upper()
+        popularity = lines.drop_duplicates(['invoiceno', 'key'])['key'].value_counts()
+        spelling = lines.groupby(['key', 'raw']).size().reset_index(name='n') \
+            .sort_values(['key', 'n'], ascending=[True, False]).drop_duplicates('key').set_index('key')['raw']
+        # Most popular first; ties in name order so the numbering is deterministic
+        ranked = pd.DataFrame({'key': popularity.index, 'count': popularity.to_numpy()}) \
+            .sort_values(['count', 'key'], ascending=[False, True], kind='stable')
+        return cls.from_names(ranked['key'].tolist(), spelling.loc[ranked['key']].tolist(), ranked['count'].to_numpy())
+
+    @classmethod
+    def from_names(cls, normalized, display=None, invoice_counts=None):
+        """
+        Catalog over already ranked, normalized names (product i has rank i).
+        Without counts, every product gets a count of zero and the given order is kept.
+        """
+        display = list(normalized) if display is None else list(display)
+        counts = np.zeros(len(normalized), dtype=np.int64) if invoice_counts is None else invoice_counts
+        vocab, pairs = {}, []
+        for product, name in enumerate(normalized):
+            for gram in trigrams(name):
+                pairs.append((vocab.setdefault(gram, len(vocab)), product))
+        pairs = np.array(sorted(pairs), dtype=np.int64).reshape(-1, 2)
+        indptr = np.concatenate([[0], np.cumsum(np.bincount(pairs[:, 0], minlength=len(vocab)))])
+        return cls(display, normalized, counts, list(vocab), indptr, pairs[:, 1].astype(np.int32))
+
+    @classmethod
+    def from_products(cls, products):
+        """
+        Catalog from a plain product list (e.g. unique_products.pkl), without popularity.
+        """
+        keys, display = {}, []
+        for product in products:
+            key = normalize_item(product)
+            if key not in keys:
+                keys[key] = len(keys)
+                display.append(str(product).strip())
+        return cls.from_names(list(keys), display)
+
+    def __len__(self):
+        return len(self.normalized)
+
+    def prefix(self, query, limit=10):
+        """
+        Most popular product ids whose normalized name starts with query.
+        """
+        lo = bisect.bisect_left(self.sorted_names, query)
+        hi = bisect.bisect_left(self.sorted_names, query + "\uffff", lo)
+        ids = self.by_name[lo:hi]
+        if len(ids) > limit:
+            ids = np.partition(ids, limit - 1)[:limit]
+        return np.sort(ids).tolist()
+
+    def contains(self, query, limit=10, exclude=()):
+        """
+        Most popular product ids whose normalized name contains query (3+ characters).
+        """
+        postings = []
+        for gram in trigrams(query):
+            gram_id = self.trigram_ids.get(gram)
+            if gram_id is None:
+                return []
+            postings.append(self.trigram_indices[self.trigram_indptr[gram_id]:self.trigram_indptr[gram_id + 1]])
+        postings.sort(key=len)
+        candidates = postings[0]
+        for other in postings[1:]:
+            candidates = np.intersect1d(candidates, other, assume_unique=True)
+        result = []
+        for product in candidates.tolist():
+            if product not in exclude and query in self.normalized[product]:
+                result.append(product)
+                if len(result) >= limit:
+                    break
+        return result
+
+    def search(self, query, limit=10):
+        """
+        Typeahead: display names of the best matches for query, name prefixes
+        first and then (for 3+ characters) other names containing it, each
+        group ranked by popularity.
+        """
+        query = normalize_item(query)
+        if not query:
+            return self.display[:limit]
+        ids = self.prefix(query, limit)
+        if len(ids) < limit and len(query) >= 3:
+            ids += self.contains(query, limit - len(ids), exclude=set(ids))
+        return [self.display[i] for i in ids]
+
+    def popular(self, limit=10):
+        return self.display[:limit]
+
+    def normalize(self, names):
+        """
+        Normalized keys for display names (lookup, falling back to normalize_item for unknown names).
+        """
+        return [self.normalized_of.get(name) or normalize_item(name) for name in names]
+
+    def save(self, path):
+        arrays = {'invoice_counts': self.invoice_counts, 'trigram_indptr': self.trigram_indptr,
+                  'trigram_indices': self.trigram_indices}
+        trigram_keys = sorted(self.trigram_ids, key=self.trigram_ids.get)
+        write_array_dir(path, self.ARTIFACT_KIND, arrays,
+                        {'display': self.display, 'normalized': self.normalized, 'trigrams': trigram_keys})
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        meta, arrays = read_array_dir(path, cls.ARTIFACT_KIND, mmap=mmap)
+        return cls(meta['display'], meta['normalized'], arrays['invoice_counts'], meta['trigrams'],
+                   arrays['trigram_indptr'], arrays['trigram_indices'])
@@ -0,0 +1,208 @@
+import random
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from core.recommendation import RuleIndex, normalize_item, encode_transactions
+from core.mining import mine_frequent_itemsets, filter_itemsets, rules_from_itemsets, resolve_n_jobs
+from core.instrumentation import span, count
+
+def time_split(df, test_fraction=0.2):
+    """
+    Splits transaction lines by invoice time: the latest test_fraction of
+    invoices (by their first line's invoicedate) are held out.
+    Returns (train, test).
+    """
+    first_seen = df.groupby('invoiceno', sort=False)['invoicedate'].min().sort_values(kind='stable')
+    n_test = int(round(len(first_seen) * test_fraction))
+    test_invoices = first_seen.index[len(first_seen) - n_test:]
+    is_test = df['invoiceno'].isin(test_invoices)
+    return df[~is_test], df[is_test]
+
+def holdout_queries(test, n_hidden=1, min_items=2, max_queries=None, seed=0):
+    """
+    Turns held-out invoices into (visible basket, hidden items) queries: n_hidden
+    random distinct products of each invoice are hidden and the rest form the
+    basket. Invoices with fewer than min_items (and at least n_hidden + 1)
+    distinct products are skipped.
+    """
+    rng = np.random.default_rng(seed)
+    lines = test[['invoiceno', 'description']].drop_duplicates()
+    baskets = lines.groupby('invoiceno', sort=True)['description'].apply(lambda x: x.astype(str).tolist())
+    baskets = baskets[baskets.str.len() >= max(min_items, n_hidden + 1)]
+    if max_queries is not None and len(baskets) > max_queries:
+        baskets = baskets.iloc[np.sort(rng.choice(len(baskets), max_queries, replace=False))]
+
+    queries = []
+    for items in baskets:
+        hidden = set(rng.choice(len(items), n_hidden, replace=False).tolist())
+        queries.append(([item for i, item in enumerate(items) if i not in hidden],
+                        [items[i] for i in sorted(hidden)]))
+    return queries
+
+# Rule index of the replay workers, set once per process by the pool initializer
+_REPLAY_INDEX = None
+
+def _init_replay(index):
+    global _REPLAY_INDEX
+    _REPLAY_INDEX = index
+
+def _replay_chunk(task):
+    """
+    Replays one chunk of queries. Returns, per query, the rank (1-based) of the
+    first hidden item among the recommendations (0 = miss), the number of hidden
+    items recovered, whether any rule matched the basket and the latency, plus
+    the set of recommended items.
+    """
+    queries, top_n, seed = task
+    index = _REPLAY_INDEX
+    rng = random.Random(seed)
+    first_hit = np.zeros(len(queries), dtype=np.int32)
+    recovered = np.zeros(len(queries), dtype=np.int32)
+    matched = np.zeros(len(queries), dtype=bool)
+    latencies = np.empty(len(queries))
+    recommended = set()
+    for i, (basket, hidden) in enumerate(queries):
+        start = time.perf_counter()
+        basket_ids = index.encode_basket(basket)
+        strict, partial = index.match(basket_ids)
+        recs = index.rank(basket_ids, strict, partial, top_n, rng)
+        latencies[i] = time.perf_counter() - start
+
+        hidden = {normalize_item(h) for h in hidden}
+        ranks = [r + 1 for r, item in enumerate(recs) if normalize_item(item) in hidden]
+        first_hit[i] = ranks[0] if ranks else 0
+        recovered[i] = len(ranks)
+        matched[i] = len(partial) > 0
+        recommended.update(recs)
+    return first_hit, recovered, matched, latencies, recommended
+
+def replay(rules, queries, top_n=5, n_jobs=1, chunk_size=2000, seed=0):
+    """
+    Replays (basket, hidden) queries through the rule index (same code path as
+    RuleIndex.recommend), in chunks spread over n_jobs worker processes.
+    The diversity shuffle is seeded per chunk, so results do not depend on n_jobs.
+    Returns a dict of per-query arrays (first_hit, recovered, matched, latency)
+    and the set of recommended items.
+    """
+    index = rules if isinstance(rules, RuleIndex) else RuleIndex(rules)
+    tasks = [(queries[start:start + chunk_size], top_n, seed + chunk_id)
+             for chunk_id, start in enumerate(range(0, len(queries), chunk_size))]
+    n_jobs = min(resolve_n_jobs(n_jobs), max(len(tasks), 1))
+
+    if n_jobs == 1:
+        _init_replay(index)
+        parts = [_replay_chunk(task) for task in tasks]
+    else:
+        parts = []
+        with ProcessPoolExecutor(n_jobs, initializer=_init_replay, initargs=(index,)) as pool:
+            # Bounded number of chunks in flight, results kept in input order
+            pending = deque()
+            for task in tasks:
+                pending.append(pool.submit(_replay_chunk, task))
+                if len(pending) >= 2 * n_jobs:
+                    parts.append(pending.popleft().result())
+            parts.extend(future.result() for future in pending)
+
+    if not parts:
+        empty = np.empty(0)
+        return {'first_hit': empty.astype(np.int32), 'recovered': empty.astype(np.int32),
+                'matched': empty.astype(bool), 'latency': empty, 'recommended': set(), 'rules': len(index)}
+    return {
+        'first_hit': np.concatenate([p[0] for p in parts]),
+        'recovered': np.concatenate([p[1] for p in parts]),
+        'matched': np.concatenate([p[2] for p in parts]),
+        'latency': np.concatenate([p[3] for p in parts]),
+        'recommended': set().union(*(p[4] for p in parts)),
+        'rules': len(index),
+    }
+
+def evaluate(rules, queries, top_n=5, seed=0, n_jobs=1, chunk_size=2000, cutoffs=None):
+    """
+    Offline metrics of a rule set on held-out queries:
+    - hit_rate@k: share of queries with a hidden item among the first k
+      recommendations (for every k in cutoffs, default just top_n; k <= top_n);
+    - recovered_per_query: hidden items found in the top_n, on average;
+    - query_coverage: share of queries matched by at least one rule (the rest
+      only get the global fallback);
+    - catalog_coverage: share of the products seen in the queries that are
+      recommended at least once;
+    - latency percentiles per query, in microseconds.
+    """
+    cutoffs = sorted(set(cutoffs or [top_n]))
+    if cutoffs[-1] > top_n:
+        raise ValueError(f"cutoffs must not exceed top_n ({top_n})")
+    with span("replay"):
+        result = replay(rules, queries, top_n=top_n, n_jobs=n_jobs, chunk_size=chunk_size, seed=seed)
+    count("queries", len(queries))
+
+    n = max(len(queries), 1)
+    catalog = {normalize_item(item) for basket, hidden in queries for item in basket + hidden}
+    metrics = {'queries': len(queries), 'rules': result['rules']}
+    for k in cutoffs:
+        metrics[f'hit_rate@{k}'] = float(((result['first_hit'] > 0) & (result['first_hit'] <= k)).sum() / n)
+    latency_us = result['latency'] * 1e6 if len(queries) else np.zeros(1)
+    metrics.update({
+        'recovered_per_query': float(result['recovered'].sum() / n),
+        'query_coverage': float(result['matched'].sum() / n),
+        'catalog_coverage': len({normalize_item(r) for r in result['recommended']} & catalog) / max(len(catalog), 1),
+        'mean_latency_us': float(latency_us.mean()),
+        'p50_latency_us': float(np.percentile(latency_us, 50)),
+        'p90_latency_us': float(np.percentile(latency_us, 90)),
+        'p99_latency_us': float(np.percentile(latency_us, 99)),
+    })
+    return metrics
+
+def sweep_thresholds(train, queries, supports, thresholds, top_n=5, n_jobs=None, seed=0, cutoffs=None):
+    """
+    Evaluates every (min_support, min_threshold) combination with a single mining
+    pass: itemsets are mined once at the lowest support and filtered up to each
+    higher support level (core.mining.filter_itemsets), then rules are derived
+    and replayed. Returns one row per combination (rule count plus the evaluate()
+    metrics), cheapest rule sets first within each support level; the single
+    mining pass is described in results.attrs (mined_itemsets, mining_support,
+    mining_seconds).
+    """
+    df = train[['invoiceno', 'description']].copy()
+    df['description'] = df['description'].astype(str)
+    with span("encode_baskets"):
+        matrix, items, _ = encode_transactions(df)
+    n = matrix.shape[0]
+
+    with span("mine_itemsets"):
+        start = time.perf_counter()
+        base = mine_frequent_itemsets(matrix, min(supports), n_jobs=n_jobs)
+        mining_seconds = time.perf_counter() - start
+    count("frequent_itemsets", len(base))
+
+    rows = []
+    for min_support in sorted(supports, reverse=True):
+        itemsets = filter_itemsets(base, n, min_support)
+        for min_threshold in sorted(thresholds, reverse=True):
+            with span("rules_from_itemsets"):
+                rules = rules_from_itemsets(itemsets, n, items, min_threshold)
+            if rules.empty:
+                rows.append({'min_support': min_support, 'min_threshold': min_threshold, 'itemsets': len(itemsets),
+                             'rules': 0})
+                continue
+            rules = rules.sort_values(['lift', 'confidence'], ascending=False)
+            metrics = evaluate(rules, queries, top_n=top_n, seed=seed, n_jobs=n_jobs, cutoffs=cutoffs)
+            rows.append(dict({'min_support': min_support, 'min_threshold': min_threshold,
+                              'itemsets': len(itemsets)}, **metrics))
+    results = pd.DataFrame(rows)
+    results.attrs.update(mined_itemsets=len(base), mining_support=min(supports), mining_seconds=mining_seconds)
+    return results
+
+def cheapest_within(results, metric, tolerance=0.005):
+    """
+    The row of a sweep with the fewest rules whose `metric` is within
+    `tolerance` (absolute) of the best value.
+    """
+    scored = results.dropna(subset=[metric])
+    if scored.empty:
+        return None
+    good = scored[scored[metric] >= scored[metric].max() - tolerance]
+    return good.sort_values(['rules', metric], ascending=[True, False]).iloc[0]
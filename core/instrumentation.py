@@ -0,0 +1,204 @@
+import cProfile
+import io
+import json
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+import pandas as pd
+
+try:
+    import psutil
+except ImportError: # optional: fall back to /proc, or no RSS numbers at all
+    psutil = None
+
+# The run being recorded, if any. Spans and counters are no-ops without one.
+_ACTIVE = None
+
+def current_rss():
+    """
+    Resident set size of this process in bytes, or None when it cannot be read.
+    """
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+class RunReport:
+    """
+    Records a tree of timed spans plus named counters for one pipeline run.
+
+    Every span stores its wall time and the RSS at entry, exit and the highest
+    value seen in between (sampled by a background thread every
+    `sample_interval` seconds). Counters are attached to the innermost open span
+    and summed into run-level totals.
+
+    With profile_stage set, the span of that name is additionally captured with
+    cProfile (profile_mode="cprofile", writes <name>.prof into profile_dir) or
+    tracemalloc (profile_mode="tracemalloc", top allocation sites), and a summary
+    is stored in the span.
+    """
+
+    def __init__(self, name, profile_stage=None, profile_mode="cprofile", profile_dir=".", sample_interval=0.01,
+                 top=25):
+        if profile_mode not in ("cprofile", "tracemalloc"):
+            raise ValueError(f"Unknown profile_mode '{profile_mode}', expected 'cprofile' or 'tracemalloc'")
+        self.name = name
+        self.profile_stage = profile_stage
+        self.profile_mode = profile_mode
+        self.profile_dir = profile_dir
+        self.sample_interval = sample_interval
+        self.top = top
+        self.root = {'name': name, 'children': [], 'counters': {}}
+        self.counters = {}
+        self._stack = [self.root]
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._sampler = None
+
+    def _sample(self):
+        while not self._stop.wait(self.sample_interval):
+            rss = current_rss()
+            with self._lock:
+                for span in self._stack:
+                    if rss is not None and rss > (span.get('peak_rss') or 0):
+                        span['peak_rss'] = rss
+
+    def __enter__(self):
+        global _ACTIVE
+        if _ACTIVE is not None:
+            raise RuntimeError("A run report is already being recorded")
+        _ACTIVE = self
+        self.root['started'] = pd.Timestamp.now(tz="UTC").isoformat()
+        self.root['rss_start'] = self.root['peak_rss'] = current_rss()
+        self._start = time.perf_counter()
+        self._sampler = threading.Thread(target=self._sample, daemon=True)
+        self._sampler.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        global _ACTIVE
+        self._stop.set()
+        self._sampler.join()
+        self._close(self.root, self._start, exc_type)
+        _ACTIVE = None
+        return False
+
+    def _close(self, span, start, exc_type):
+        span['seconds'] = time.perf_counter() - start
+        span['rss_end'] = current_rss()
+        if span['rss_end'] is not None:
+            span['peak_rss'] = max(span.get('peak_rss') or 0, span['rss_end'])
+        if exc_type is not None:
+            span['error'] = exc_type.__name__
+
+    @contextmanager
+    def span(self, name):
+        rss = current_rss()
+        node = {'name': name, 'rss_start': rss, 'peak_rss': rss, 'children': [], 'counters': {}}
+        with self._lock:
+            self._stack[-1]['children'].append(node)
+            self._stack.append(node)
+        profiler = self._start_profile() if name == self.profile_stage else None
+        start = time.perf_counter()
+        exc_type = None
+        try:
+            yield node
+        except BaseException as exc:
+            exc_type = type(exc)
+            raise
+        finally:
+            self._close(node, start, exc_type)
+            if profiler is not None:
+                node['profile'] = self._stop_profile(profiler, name)
+            with self._lock:
+                self._stack.pop()
+
+    def count(self, name, value=1):
+        with self._lock:
+            span_counters = self._stack[-1]['counters']
+            span_counters[name] = span_counters.get(name, 0) + value
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def _start_profile(self):
+        if self.profile_mode == "cprofile":
+            profiler = cProfile.Profile()
+            profiler.enable()
+            return profiler
+        started = not tracemalloc.is_tracing()
+        if started:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        return started
+
+    def _stop_profile(self, profiler, name):
+        if self.profile_mode == "cprofile":
+            profiler.disable()
+            path = os.path.join(self.profile_dir, f"{name}.prof")
+            profiler.dump_stats(path)
+            text = io.StringIO()
+            pstats.Stats(profiler, stream=text).sort_stats("cumulative").print_stats(self.top)
+            return {'mode': 'cprofile', 'path': path, 'summary': text.getvalue()}
+
+        snapshot = tracemalloc.take_snapshot()
+        peak = tracemalloc.get_traced_memory()[1]
+        if profiler:
+            tracemalloc.stop()
+        return {
+            'mode': 'tracemalloc',
+            'peak_traced_bytes': peak,
+            'top': [{'site': str(stat.traceback), 'bytes': stat.size, 'blocks': stat.count}
+                    for stat in snapshot.statistics("lineno")[:self.top]],
+        }
+
+    def to_dict(self):
+        return dict(self.root, totals=dict(self.counters))
+
+    def write(self, path):
+        """
+        Writes the run report as JSON.
+        """
+        with open(path + ".tmp", "w") as f:
+            json.dump(self.to_dict(), f, indent=2, default=str)
+        os.replace(path + ".tmp", path)
+
+    def summary(self):
+        """
+        Indented one-line-per-span text view: time, peak RSS and counters.
+        """
+        lines = []
+        def walk(span, depth):
+            peak = f"{span['peak_rss'] / 1e6:8.1f} MB" if span.get('peak_rss') else f"{'-':>11}"
+            counters = ", ".join(f"{k}={v:,}" for k, v in span['counters'].items())
+            lines.append(f"{'  ' * depth}{span['name']:<{32 - 2 * depth}} {span.get('seconds', 0):8.3f}s {peak}  {counters}")
+            for child in span['children']:
+                walk(child, depth + 1)
+        walk(self.root, 0)
+        return "\n".join(lines)
+
+@contextmanager
+def span(name):
+    """
+    Times a stage or sub-step of the active run report; does nothing when no run is recorded.
+    """
+    if _ACTIVE is None:
+        yield None
+        return
+    with _ACTIVE.span(name) as node:
+        yield node
+
+def count(name, value=1):
+    """
+    Adds `value` to a counter of the active run report (no-op without one).
+    """
+    if _ACTIVE is not None:
+        _ACTIVE.count(name, int(value))
+
+def active_report():
+    return _ACTIVE
@@ -0,0 +1,313 @@
+import pandas as pd
+import numpy as np
+import math
+import os
+import joblib
+from scipy import sparse
+from itertools import combinations
+from concurrent.futures import ProcessPoolExecutor
+
+RULE_COLUMNS = [
+    'antecedents', 'consequents', 'antecedent support', 'consequent support',
+    'support', 'confidence', 'lift', 'representativity', 'leverage',
+    'conviction', 'zhangs_metric', 'jaccard', 'certainty', 'kulczynski'
+]
+
+if hasattr(np, 'bitwise_count'):
+    def popcount(bits):
+        return np.bitwise_count(bits).sum(axis=-1, dtype=np.int64)
+else:
+    _BYTE_COUNTS = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+    def popcount(bits):
+        return _BYTE_COUNTS[bits.view(np.uint8)].sum(axis=-1, dtype=np.int64)
+
+def resolve_n_jobs(n_jobs):
+    if n_jobs is None or n_jobs < 1:
+        return os.cpu_count() or 1
+    return n_jobs
+
+def column_bitsets(matrix, columns):
+    """
+    Vertical layout of a boolean CSR basket: one packed uint64 bitset (tid-list)
+    per requested column, shape (len(columns), ceil(invoices / 64)).
+    """
+    n_words = (matrix.shape[0] + 63) // 64
+    csc = matrix[:, columns].tocsc()
+    bits = np.zeros(len(columns) * n_words, dtype=np.uint64)
+    rows = csc.indices.astype(np.int64)
+    cols = np.repeat(np.arange(len(columns), dtype=np.int64), np.diff(csc.indptr))
+    np.bitwise_or.at(bits, cols * n_words + (rows >> 6), np.left_shift(np.uint64(1), (rows & 63).astype(np.uint64)))
+    return bits.reshape(len(columns), n_words)
+
+# Worker state, set once per process so tasks only carry a prefix position
+_BITSETS = None
+_MIN_COUNT = None
+
+def _init_eclat(bitsets, min_count):
+    global _BITSETS, _MIN_COUNT
+    _BITSETS, _MIN_COUNT = bitsets, min_count
+
+def _extend(prefix, bits, ext_items, ext_bits, min_count, out):
+    """
+    Intersects the prefix tid-list with every candidate extension, records the
+    frequent ones and recurses depth-first into each of them.
+    """
+    inter = ext_bits & bits
+    counts = popcount(inter)
+    keep = counts >= min_count
+    if not keep.any():
+        return
+    ext_items, inter = ext_items[keep], inter[keep]
+    for item, count in zip(ext_items, counts[keep]):
+        out[prefix + (int(item),)] = int(count)
+    for i in range(len(ext_items) - 1):
+        _extend(prefix + (int(ext_items[i]),), inter[i], ext_items[i + 1:], inter[i + 1:], min_count, out)
+
+def _mine_prefix(position):
+    """
+    Mines every frequent itemset whose first item (in mining order) is `position`.
+    """
+    out = {}
+    ext_items = np.arange(position + 1, len(_BITSETS))
+    _extend((position,), _BITSETS[position], ext_items, _BITSETS[position + 1:], _MIN_COUNT, out)
+    return out
+
+def mine_frequent_itemsets(matrix, min_support, n_jobs=None):
+    """
+    Vertical bitset Eclat over a boolean CSR basket (invoices x items).
+    Returns {itemset: count} where itemsets are sorted tuples of column indices.
+    The search is split by first item and spread across a process pool.
+    """
+    n = matrix.shape[0]
+    if n == 0:
+        return {}
+    item_counts = np.asarray(matrix.sum(axis=0)).ravel()
+    # Same thresholds as mlxtend: float support for items, ceil'd count for itemsets
+    frequent = np.flatnonzero(item_counts / float(n) >= min_support)
+    min_count = math.ceil(min_support * n)
+
+    # Least frequent first keeps the intersections deep in the search small
+    frequent = frequent[np.argsort(item_counts[frequent], kind='stable')]
+    itemsets = {(int(i),): int(item_counts[i]) for i in frequent}
+    if len(frequent) < 2:
+        return itemsets
+    bitsets = column_bitsets(matrix, frequent)
+
+    n_jobs = min(resolve_n_jobs(n_jobs), len(frequent) - 1)
+    if n_jobs == 1:
+        _init_eclat(bitsets, min_count)
+        parts = [_mine_prefix(p) for p in range(len(frequent) - 1)]
+    else:
+        with ProcessPoolExecutor(n_jobs, initializer=_init_eclat, initargs=(bitsets, min_count)) as pool:
+            parts = list(pool.map(_mine_prefix, range(len(frequent) - 1)))
+
+    for part in parts:
+        for positions, count in part.items():
+            itemsets[tuple(sorted(int(frequent[p]) for p in positions))] = count
+    return itemsets
+
+def filter_itemsets(itemsets, n_transactions, min_support):
+    """
+    The subset of {itemset: count} that mine_frequent_itemsets would return at a
+    higher min_support (same thresholds), so one mining pass at the lowest
+    support can serve a whole sweep of support levels.
+    """
+    min_count = math.ceil(min_support * n_transactions)
+    return {k: v for k, v in itemsets.items()
+            if (v / float(n_transactions) >= min_support if len(k) == 1 else v >= min_count)}
+
+def _candidate_rules(keys, supports, min_confidence):
+    ant, con, s_ac, s_a, s_c = [], [], [], [], []
+    for itemset in keys:
+        sup = supports[itemset]
+        for size in range(len(itemset) - 1, 0, -1):
+            for antecedent in combinations(itemset, size):
+                sup_a = supports[antecedent]
+                if sup / sup_a < min_confidence:
+                    continue
+                consequent = tuple(i for i in itemset if i not in antecedent)
+                ant.append(antecedent)
+                con.append(consequent)
+                s_ac.append(sup)
+                s_a.append(sup_a)
+                s_c.append(supports[consequent])
+    return ant, con, s_ac, s_a, s_c
+
+def rules_from_itemsets(itemsets, n_transactions, items, min_threshold=0.3):
+    """
+    Builds the association rules DataFrame (same columns and metric definitions as
+    mlxtend's association_rules with metric="confidence") from {itemset: count}.
+    Runs in-process: shipping candidate rules back from workers costs more than
+    enumerating them.
+    """
+    supports = {k: v / float(n_transactions) for k, v in itemsets.items()}
+    keys = [k for k in supports if len(k) > 1]
+    if not keys:
+        return pd.DataFrame(columns=RULE_COLUMNS)
+
+    ant, con, sAC, sA, sC = _candidate_rules(keys, supports, min_threshold)
+    sAC, sA, sC = np.asarray(sAC, dtype=float), np.asarray(sA, dtype=float), np.asarray(sC, dtype=float)
+    confidence = sAC / sA
+
+    leverage = sAC - sA * sC
+    conviction = np.full(len(confidence), np.inf)
+    below = confidence < 1.0
+    conviction[below] = (1.0 - sC[below]) / (1.0 - confidence[below])
+    denominator = np.maximum(sAC * (1 - sA), sA * (sC - sAC))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        zhangs = np.where(denominator == 0, 0, leverage / denominator)
+        certainty = np.where(1 - sC == 0, 0, (confidence - sC) / (1 - sC))
+
+    items, names = list(items), {}
+    def to_names(itemset):
+        if itemset not in names:
+            names[itemset] = frozenset(items[i] for i in itemset)
+        return names[itemset]
+
+    return pd.DataFrame({
+        'antecedents': [to_names(a) for a in ant],
+        'consequents': [to_names(c) for c in con],
+        'antecedent support': sA,
+        'consequent support': sC,
+        'support': sAC,
+        'confidence': confidence,
+        'lift': confidence / sC,
+        'representativity': np.ones(len(confidence)),
+        'leverage': leverage,
+        'conviction': conviction,
+        'zhangs_metric': zhangs,
+        'jaccard': sAC / (sA + sC - sAC),
+        'certainty': certainty,
+        'kulczynski': (sAC / sA + sAC / sC) / 2,
+    }, columns=RULE_COLUMNS)
+
+STATE_VERSION = 1
+
+def count_itemsets(bits, rows, chunk_size=1024):
+    """
+    Support counts for equal-length itemsets given as a 2D array of rows into
+    `bits` (one row of bitset positions per itemset). Intersections are done
+    chunk_size itemsets at a time to bound the temporary bitset memory.
+    """
+    counts = np.empty(len(rows), dtype=np.int64)
+    for start in range(0, len(rows), chunk_size):
+        block = rows[start:start + chunk_size]
+        acc = bits[block[:, 0]]
+        for j in range(1, block.shape[1]):
+            acc &= bits[block[:, j]]
+        counts[start:start + chunk_size] = popcount(acc)
+    return counts
+
+def _apriori_gen(level):
+    """
+    Candidate (k+1)-itemsets from a sorted list of frequent k-itemsets: join pairs
+    sharing a (k-1)-prefix and drop candidates with an infrequent k-subset.
+    """
+    known = set(level)
+    groups = {}
+    for itemset in level:
+        groups.setdefault(itemset[:-1], []).append(itemset[-1])
+    candidates = []
+    for prefix, tails in groups.items():
+        for a in range(len(tails)):
+            for b in range(a + 1, len(tails)):
+                candidate = prefix + (tails[a], tails[b])
+                if all(candidate[:j] + candidate[j + 1:] in known for j in range(len(prefix))):
+                    candidates.append(candidate)
+    return candidates
+
+def build_itemset_state(matrix, items, invoices, min_support, n_jobs=None):
+    """
+    Full mine of a CSR basket, keeping everything needed to merge later invoices
+    without re-mining: the encoded history, item counts and frequent itemset counts.
+    """
+    return {
+        'version': STATE_VERSION,
+        'min_support': min_support,
+        'items': list(items),
+        'invoices': set(invoices),
+        'history': matrix,
+        'item_counts': np.asarray(matrix.sum(axis=0)).ravel().astype(np.int64),
+        'itemsets': mine_frequent_itemsets(matrix, min_support, n_jobs=n_jobs),
+    }
+
+def update_itemset_state(state, matrix, items, invoices):
+    """
+    FUP-style merge of new invoices into an itemset state, in place.
+
+    `matrix` holds only the new invoices, with columns following `items` (the state
+    vocabulary plus any new products appended). Candidates are generated level by
+    level from the itemsets frequent in the merged data. Known frequent itemsets get
+    their new-invoice counts added. Any other candidate must be frequent enough among
+    the new invoices to make up for staying below min_support in the history; only
+    those are counted against the stored history.
+    Returns the number of candidates that needed a history count.
+    """
+    if matrix.shape[0] == 0:
+        return 0
+    min_support = state['min_support']
+    history = state['history']
+    n_old, n_new = history.shape[0], matrix.shape[0]
+    n = n_old + n_new
+    n_items = len(items)
+
+    history = sparse.csr_matrix((history.data, history.indices, history.indptr), shape=(n_old, n_items))
+    new_item_counts = np.asarray(matrix.sum(axis=0)).ravel().astype(np.int64)
+    item_counts = np.concatenate([state['item_counts'], np.zeros(n_items - len(state['item_counts']), dtype=np.int64)])
+    item_counts += new_item_counts
+
+    min_count = math.ceil(min_support * n)
+    # Itemsets missing from the old state had a history count of at most this
+    history_slack = max(math.ceil(min_support * n_old) - 1, 0)
+
+    frequent = np.flatnonzero(item_counts / float(n) >= min_support)
+    itemsets = {(int(i),): int(item_counts[i]) for i in frequent}
+    positions = np.full(n_items, -1, dtype=np.int64)
+    positions[frequent] = np.arange(len(frequent))
+    new_bits = column_bitsets(matrix, frequent)
+    history_bits = None
+
+    old_itemsets = state['itemsets']
+    level = sorted(itemsets)
+    rescanned = 0
+    while level:
+        candidates = _apriori_gen(level)
+        if not candidates:
+            break
+        rows = positions[np.asarray(candidates)]
+        counts = count_itemsets(new_bits, rows)
+        known = np.fromiter((c in old_itemsets for c in candidates), dtype=bool, count=len(candidates))
+        counts[known] += np.fromiter((old_itemsets[c] for c, k in zip(candidates, known) if k), dtype=np.int64)
+
+        rescan = ~known & (counts >= min_count - history_slack)
+        if rescan.any():
+            if history_bits is None:
+                history_bits = column_bitsets(history, frequent)
+            counts[rescan] += count_itemsets(history_bits, rows[rescan])
+            rescanned += int(rescan.sum())
+        counts[~known & ~rescan] = 0
+
+        level = [c for c, count in zip(candidates, counts) if count >= min_count]
+        itemsets.update((c, int(count)) for c, count in zip(candidates, counts) if count >= min_count)
+
+    state['items'] = list(items)
+    state['invoices'].update(invoices)
+    state['history'] = sparse.vstack([history, matrix], format='csr')
+    state['item_counts'] = item_counts
+    state['itemsets'] = itemsets
+    return rescanned
+
+def save_itemset_state(state, path):
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    # Write then swap, so a crashed nightly run never leaves a truncated state behind
+    joblib.dump(state, path + ".tmp")
+    os.replace(path + ".tmp", path)
+
+def load_itemset_state(path):
+    state = joblib.load(path)
+    if state.get('version') != STATE_VERSION:
+        raise ValueError(f"Unsupported itemset state version {state.get('version')} in {path}, run a full retrain")
+    return state
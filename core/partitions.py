@@ -0,0 +1,238 @@
+import os
+import random
+import shutil
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+
+from core.artifacts import write_array_dir, read_array_dir
+from core.mining import mine_frequent_itemsets, rules_from_itemsets, resolve_n_jobs
+from core.recommendation import RuleIndex, encode_transactions, compact_rules
+from core.instrumentation import span, count
+
+PARTITION_INPUT_COLUMNS = ['invoiceno', 'description', 'customerid', 'invoicedate']
+
+def invoice_partitions(df, invoices, segments=None, window=None, step=None, min_invoices=1):
+    """
+    Splits the invoices (rows of an encoded basket, labelled by `invoices`) into
+    partitions:
+    - per RFM segment, with segments a table of customerid -> segment (e.g.
+      rfm_segments) joined on each invoice's customer;
+    - per rolling time window of length `window` (e.g. "90D"), starting every
+      `step` (default: window, i.e. no overlap) from the first invoice date;
+    - per (segment, window) pair when both are given.
+    Partitions with fewer than min_invoices invoices are dropped. Returns a list
+    of dicts (key, segment, window as [start, end) ISO dates, rows).
+    """
+    per_invoice = df.groupby('invoiceno', sort=False).agg(
+        customerid=('customerid', 'first'), invoicedate=('invoicedate', 'min')).reindex(invoices)
+    parts = [{'key': [], 'segment': None, 'window': None, 'mask': np.ones(len(invoices), dtype=bool)}]
+
+    if segments is not None:
+        segment_of = segments.drop_duplicates('customerid').set_index('customerid')['segment'].astype(str)
+        invoice_segment = per_invoice['customerid'].map(segment_of).to_numpy()
+        parts = [dict(p, key=p['key'] + [f"segment={name}"], segment=name, mask=p['mask'] & (invoice_segment == name))
+                 for p in parts for name in sorted(pd.unique(invoice_segment[pd.notna(invoice_segment)]))]
+
+    if window is not None:
+        window = pd.Timedelta(window)
+        step = window if step is None else pd.Timedelta(step)
+        dates = per_invoice['invoicedate'].to_numpy()
+        first, last = pd.Timestamp(dates.min()).floor('D'), pd.Timestamp(dates.max())
+        windows = []
+        start = first
+        while start <= last:
+            end = start + window
+            windows.append((start, end, (dates >= start.to_datetime64()) & (dates < end.to_datetime64())))
+            start += step
+        parts = [dict(p, key=p['key'] + [f"window={start.date()}"], window=[str(start.date()), str(end.date())],
+                      mask=p['mask'] & in_window)
+                 for p in parts for start, end, in_window in windows]
+
+    result = []
+    for p in parts:
+        rows = np.flatnonzero(p['mask'])
+        if p['key'] and len(rows) >= max(min_invoices, 1):
+            result.append({'key': "&".join(p['key']), 'segment': p['segment'], 'window': p['window'], 'rows': rows})
+    return result
+
+# Encoded basket of the partition workers, set once per process by the pool initializer
+_PARTITION_MATRIX = None
+_PARTITION_ITEMS = None
+
+def _init_partition_mining(matrix, items):
+    global _PARTITION_MATRIX, _PARTITION_ITEMS
+    _PARTITION_MATRIX, _PARTITION_ITEMS = matrix, items
+
+def _mine_partition(task):
+    """
+    Mines one partition: its rows of the shared basket, with min_support relative
+    to the partition's own invoice count, then optional compaction.
+    """
+    key, rows, min_support, min_threshold, compact = task
+    basket = _PARTITION_MATRIX[rows]
+    itemsets = mine_frequent_itemsets(basket, min_support, n_jobs=1)
+    rules = rules_from_itemsets(itemsets, len(rows), _PARTITION_ITEMS, min_threshold)
+    if compact is not None:
+        rules = compact_rules(rules, **compact)
+    return key, len(itemsets), rules.sort_values(['lift', 'confidence'], ascending=False)
+
+def mine_partitions(df, segments=None, window=None, step=None, min_support=0.01, min_threshold=0.2, min_invoices=200,
+                    compact=None, n_jobs=None):
+    """
+    Partitioned rule mining: the transactions are encoded into one basket
+    matrix, split into partitions (see invoice_partitions) and every partition
+    is mined concurrently in a process pool that receives the matrix once per
+    worker; tasks only carry row indices. Because support is relative to each
+    partition, items that are frequent within a segment or season survive even
+    when they are rare overall. `compact` (keyword arguments of compact_rules)
+    compacts each partition's rules.
+    Returns (partitions, rules by key), where partitions are the metadata dicts
+    of invoice_partitions with the invoice, itemset and rule counts added.
+    """
+    df = df.copy()
+    df['description'] = df['description'].astype(str)
+    with span("encode_baskets"):
+        matrix, items, invoices = encode_transactions(df)
+    with span("partition_invoices"):
+        partitions = invoice_partitions(df, invoices, segments, window, step, min_invoices)
+    count("partitions", len(partitions))
+    tasks = [(p['key'], p['rows'], min_support, min_threshold, compact)
+             for p in sorted(partitions, key=lambda p: -len(p['rows']))]
+    n_jobs = min(resolve_n_jobs(n_jobs), max(len(tasks), 1))
+
+    results = {}
+    with span("mine_partitions"):
+        if n_jobs == 1:
+            _init_partition_mining(matrix, list(items))
+            for task in tasks:
+                key, n_itemsets, rules = _mine_partition(task)
+                results[key] = (n_itemsets, rules)
+        else:
+            # Largest partitions are submitted first so the pool finishes evenly
+            with ProcessPoolExecutor(n_jobs, initializer=_init_partition_mining,
+                                     initargs=(matrix, list(items))) as pool:
+                for future in as_completed([pool.submit(_mine_partition, task) for task in tasks]):
+                    key, n_itemsets, rules = future.result()
+                    results[key] = (n_itemsets, rules)
+
+    rules_by_key = {}
+    for p in partitions:
+        n_itemsets, rules = results[p['key']]
+        p.update(invoices=len(p.pop('rows')), itemsets=n_itemsets, rules=len(rules))
+        rules_by_key[p['key']] = rules
+        count("rules", len(rules))
+    return partitions, rules_by_key
+
+class PartitionedRules:
+    """
+    Partition-keyed rule store with a global fallback.
+
+    Holds a RuleIndex per non-empty partition plus the global index. For a
+    basket, the candidate rule sets are tried from most to least specific:
+    (segment, window), segment, window, then global; the first one whose rules
+    match the basket at all (strict or partial) is used, so a customer's segment
+    rules take over wherever they apply and the global rules cover the rest.
+    """
+
+    ARTIFACT_KIND = "partitioned_rules"
+
+    def __init__(self, global_index, indexes, partitions):
+        self.global_index = global_index
+        self.indexes = indexes
+        self.partitions = list(partitions)
+        self.by_segment_window = {(p['segment'], tuple(p['window']) if p['window'] else None): p['key']
+                                  for p in self.partitions if p['key'] in indexes}
+        self.windows = sorted({tuple(p['window']) for p in self.partitions if p['window']})
+
+    @classmethod
+    def build(cls, global_rules, partitions, rules_by_key):
+        """
+        Store over the output of mine_partitions and the global rules (DataFrame or RuleIndex).
+        """
+        global_index = global_rules if isinstance(global_rules, RuleIndex) else RuleIndex(global_rules)
+        indexes = {key: RuleIndex(rules) for key, rules in rules_by_key.items() if not rules.empty}
+        return cls(global_index, indexes, partitions)
+
+    def __len__(self):
+        return len(self.indexes)
+
+    def window_for(self, when):
+        """
+        The window containing `when` (the latest starting one if windows
+        overlap); past the last window, the last one. None before the first.
+        """
+        when = pd.Timestamp(when)
+        candidates = [w for w in self.windows if pd.Timestamp(w[0]) <= when]
+        if not candidates:
+            return None
+        containing = [w for w in candidates if when < pd.Timestamp(w[1])]
+        return (containing or candidates)[-1]
+
+    def chain(self, segment=None, when=None):
+        """
+        Keys of the partition rule sets to try for a customer segment and date,
+        most specific first (the global index is always tried last).
+        """
+        window = self.window_for(when) if when is not None and self.windows else None
+        keys = []
+        for segment_window in [(segment, window), (segment, None), (None, window)]:
+            key = self.by_segment_window.get(segment_window)
+            if key is not None and key not in keys:
+                keys.append(key)
+        return keys
+
+    def index_for(self, key):
+        return self.global_index if key is None else self.indexes[key]
+
+    def select(self, basket_items, segment=None, when=None, normalized=False):
+        """
+        (key, RuleIndex, match) of the first rule set in the chain that matches
+        the basket, where match is (basket_ids, strict, partial) for reuse by the
+        caller; (None, global index, None) when no partition rule set matches.
+        """
+        for key in self.chain(segment, when):
+            index = self.indexes[key]
+            basket_ids = index.encode_basket(basket_items, normalized)
+            strict, partial = index.match(basket_ids)
+            if len(partial) > 0:
+                return key, index, (basket_ids, strict, partial)
+        return None, self.global_index, None
+
+    def recommend(self, basket_items, segment=None, when=None, top_n=5, rng=random, normalized=False):
+        _, index, match = self.select(basket_items, segment, when, normalized)
+        if match is None:
+            return index.recommend(basket_items, top_n=top_n, rng=rng, normalized=normalized)
+        return index.rank(*match, top_n, rng)
+
+    def save(self, path):
+        """
+        Writes the global index and one rules artifact per partition under path,
+        plus the partition table; the directory is swapped in at the end.
+        """
+        tmp_path = path + ".tmp"
+        if os.path.exists(tmp_path):
+            shutil.rmtree(tmp_path)
+        os.makedirs(tmp_path)
+        self.global_index.save(os.path.join(tmp_path, "global"))
+        directories = {}
+        for i, key in enumerate(sorted(self.indexes)):
+            directories[key] = f"partition_{i:04d}"
+            self.indexes[key].save(os.path.join(tmp_path, directories[key]))
+        partitions = [dict(p, directory=directories.get(p['key'])) for p in self.partitions]
+        write_array_dir(os.path.join(tmp_path, "partitions"), self.ARTIFACT_KIND,
+                        {'invoices': np.array([p['invoices'] for p in partitions], dtype=np.int64),
+                         'rules': np.array([p['rules'] for p in partitions], dtype=np.int64)},
+                        {'partitions': partitions})
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        meta, _ = read_array_dir(os.path.join(path, "partitions"), cls.ARTIFACT_KIND, mmap=mmap)
+        indexes = {p['key']: RuleIndex.load(os.path.join(path, p['directory']), mmap=mmap)
+                   for p in meta['partitions'] if p['directory'] is not None}
+        partitions = [{k: v for k, v in p.items() if k != 'directory'} for p in meta['partitions']]
+        return cls(RuleIndex.load(os.path.join(path, "global"), mmap=mmap), indexes, partitions)
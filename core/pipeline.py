@@ -0,0 +1,345 @@
+import copy
+import hashlib
+import json
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+import joblib
+import pandas as pd
+
+from core.data_processing import cache_dataset, file_digest
+from core.rfm_model import calculate_rfm, train_kmeans, save_model, save_segments, RFM_INPUT_COLUMNS
+from core.recommendation import generate_rules, compact_rules, save_rules, RULE_INPUT_COLUMNS
+from core.analytics import SegmentStore
+from core.catalog import ProductCatalog
+from core.partitions import mine_partitions, PartitionedRules, PARTITION_INPUT_COLUMNS
+from core.instrumentation import RunReport, span, count
+
+# Paths and parameters of a training run. A JSON config file only needs the
+# keys it changes (nested sections are merged).
+DEFAULT_CONFIG = {
+    'data': r"d:/data/data/data.csv",
+    'artifacts_dir': "artifacts",
+    'serving_dir': r"d:/data/artifacts",
+    'cache_dir': os.path.join("artifacts", "cache"),
+    'work_dir': os.path.join("artifacts", "pipeline"),
+    'rfm': {'n_clusters': 5, 'mode': "full", 'batch_size': 4096},
+    'rules': {'min_support': 0.005, 'min_threshold': 0.2, 'encoding': "sparse", 'engine': "native", 'n_jobs': None,
+              'state_path': os.path.join("artifacts", "rule_state.pkl")},
+    'compact': {'min_lift': 1.0, 'top_k': 10, 'drop_redundant': True},
+    # Opt-in per-segment and/or per-window rule sets: "by" lists any of "segment" and "window" ([] skips the stage)
+    'partitions': {'by': [], 'window': "90D", 'step': None, 'min_support': 0.01, 'min_threshold': 0.2,
+                   'min_invoices': 200, 'n_jobs': None},
+}
+
+def merge_config(base, overrides):
+    merged = copy.deepcopy(base)
+    for key, value in overrides.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = merge_config(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+def load_config(path=None, overrides=()):
+    """
+    DEFAULT_CONFIG merged with an optional JSON file and "section.key=value"
+    overrides (values are parsed as JSON when possible, e.g. rules.min_support=0.01).
+    """
+    config = copy.deepcopy(DEFAULT_CONFIG)
+    if path is not None:
+        with open(path) as f:
+            config = merge_config(config, json.load(f))
+    for override in overrides:
+        dotted, _, raw = override.partition("=")
+        try:
+            value = json.loads(raw)
+        except ValueError:
+            value = raw
+        *sections, key = dotted.split(".")
+        target = config
+        for section in sections:
+            target = target.setdefault(section, {})
+        target[key] = value
+    return config
+
+# --- Stages ---
+# Each stage is a module-level function (so it can run in a worker process)
+# taking the config and the outputs of its dependencies, and returning its own
+# outputs as a dict of file paths.
+
+def stage_clean(config, inputs):
+    cache_path, digest, _ = cache_dataset(config['data'], config['cache_dir'])
+    return {'clean': cache_path, 'source_sha256': digest}
+
+def stage_rfm(config, inputs):
+    df = pd.read_parquet(inputs['clean']['clean'], columns=RFM_INPUT_COLUMNS, memory_map=True)
+    rfm = calculate_rfm(df)
+    path = os.path.join(config['work_dir'], "rfm.parquet")
+    rfm.to_parquet(path, index=False)
+    return {'rfm': path}
+
+def stage_kmeans(config, inputs):
+    rfm = pd.read_parquet(inputs['rfm']['rfm'])
+    params = config['rfm']
+    rfm_labeled, kmeans, scaler, segment_map = train_kmeans(rfm, n_clusters=params['n_clusters'], mode=params['mode'],
+                                                            batch_size=params['batch_size'])
+    save_dir = config['artifacts_dir']
+    save_model(kmeans, "kmeans_model.pkl", save_dir)
+    save_model(scaler, "scaler.pkl", save_dir)
+    save_model(segment_map, "segment_map.pkl", save_dir)
+    path = os.path.join(config['work_dir'], "rfm_labeled.parquet")
+    rfm_labeled.to_parquet(path, index=False)
+    return {'rfm_labeled': path, 'kmeans': os.path.join(save_dir, "kmeans_model.pkl"),
+            'scaler': os.path.join(save_dir, "scaler.pkl"), 'segment_map': os.path.join(save_dir, "segment_map.pkl")}
+
+def stage_segments(config, inputs):
+    rfm_labeled = pd.read_parquet(inputs['kmeans']['rfm_labeled'])
+    save_segments(rfm_labeled, "rfm_segments.csv", save_dir=config['serving_dir'])
+    store_dir = os.path.join(config['serving_dir'], "segment_store")
+    SegmentStore.build(rfm_labeled).save(store_dir)
+    return {'segments': os.path.join(config['serving_dir'], "rfm_segments.csv"),
+            'segments_dir': os.path.join(config['serving_dir'], "rfm_segments"), 'store': store_dir}
+
+def stage_products(config, inputs):
+    df = pd.read_parquet(inputs['clean']['clean'], columns=RULE_INPUT_COLUMNS, memory_map=True)
+    all_products = sorted(df['description'].unique().astype(str))
+    count("products", len(all_products))
+    if not os.path.exists(config['serving_dir']):
+        os.makedirs(config['serving_dir'])
+    path = os.path.join(config['serving_dir'], "unique_products.pkl")
+    joblib.dump(all_products, path)
+    catalog_dir = os.path.join(config['serving_dir'], "product_catalog")
+    with span("product_catalog"):
+        ProductCatalog.build(df).save(catalog_dir)
+    return {'products': path, 'catalog': catalog_dir}
+
+def stage_rules(config, inputs):
+    df = pd.read_parquet(inputs['clean']['clean'], columns=RULE_INPUT_COLUMNS, memory_map=True)
+    params = config['rules']
+    rules = generate_rules(df, min_support=params['min_support'], min_threshold=params['min_threshold'],
+                           encoding=params['encoding'], engine=params['engine'], n_jobs=params['n_jobs'],
+                           state_path=params['state_path'] if params['engine'] == "native" else None)
+    path = os.path.join(config['work_dir'], "rules_mined.pkl")
+    joblib.dump(rules, path)
+    outputs = {'mined': path}
+    if params['engine'] == "native" and params['state_path']:
+        outputs['state'] = params['state_path']
+    return outputs
+
+def stage_compact(config, inputs):
+    rules = joblib.load(inputs['rules']['mined'])
+    params = config['compact']
+    stats = {}
+    rules = compact_rules(rules, min_lift=params['min_lift'], top_k=params['top_k'],
+                          drop_redundant=params['drop_redundant'], stats=stats)
+    for name in ('low_lift', 'redundant', 'over_top_k'):
+        count(f"pruned_{name}", stats[name])
+    save_rules(rules, "association_rules.pkl", save_dir=config['artifacts_dir'])
+    return {'rules': os.path.join(config['artifacts_dir'], "association_rules.pkl"),
+            'rules_dir': os.path.join(config['artifacts_dir'], "association_rules")}
+
+def stage_partitions(config, inputs):
+    params = config['partitions']
+    path = os.path.join(config['artifacts_dir'], "partitioned_rules")
+    if not params['by']:
+        # Disabled: drop a store left by an earlier run so it is not served
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        return {}
+    unknown = set(params['by']) - {"segment", "window"}
+    if unknown:
+        raise ValueError(f"Unknown partitioning {sorted(unknown)}, expected 'segment' and/or 'window'")
+    df = pd.read_parquet(inputs['clean']['clean'], columns=PARTITION_INPUT_COLUMNS, memory_map=True)
+    segments = None
+    if "segment" in params['by']:
+        segments = pd.read_parquet(inputs['kmeans']['rfm_labeled'], columns=['customerid', 'segment'])
+    partitions, rules_by_key = mine_partitions(
+        df, segments=segments, window=params['window'] if "window" in params['by'] else None, step=params['step'],
+        min_support=params['min_support'], min_threshold=params['min_threshold'],
+        min_invoices=params['min_invoices'], compact=config['compact'], n_jobs=params['n_jobs'])
+    global_rules = joblib.load(inputs['compact']['rules'])
+    PartitionedRules.build(global_rules, partitions, rules_by_key).save(path)
+    return {'partitioned_rules': path}
+
+class Stage:
+    """
+    A node of the training DAG: the function to run, the stages whose outputs it
+    reads and the config keys (dotted paths) it depends on. `files` are config
+    keys naming files the stage reads (and may rewrite) besides its inputs; their
+    contents are part of the cache key. always_run stages are cheap checks that
+    are executed every time (clean revalidates the data cache).
+    """
+
+    def __init__(self, name, func, deps=(), params=(), files=(), always_run=False):
+        self.name = name
+        self.func = func
+        self.deps = list(deps)
+        self.params = list(params)
+        self.files = list(files)
+        self.always_run = always_run
+
+STAGES = [
+    Stage("clean", stage_clean, params=['data', 'cache_dir'], always_run=True),
+    Stage("rfm", stage_rfm, deps=["clean"]),
+    Stage("kmeans", stage_kmeans, deps=["rfm"], params=['rfm', 'artifacts_dir']),
+    Stage("segments", stage_segments, deps=["kmeans"], params=['serving_dir']),
+    Stage("products", stage_products, deps=["clean"], params=['serving_dir']),
+    Stage("rules", stage_rules, deps=["clean"], params=['rules', 'work_dir'], files=['rules.state_path']),
+    Stage("compact", stage_compact, deps=["rules"], params=['compact', 'artifacts_dir']),
+    Stage("partitions", stage_partitions, deps=["clean", "kmeans", "compact"],
+          params=['partitions', 'compact', 'artifacts_dir']),
+]
+
+def config_value(config, dotted):
+    value = config
+    for part in dotted.split("."):
+        value = value[part]
+    return value
+
+def output_digest(outputs):
+    """
+    Content hash of a stage's outputs: every output file (or every file below an
+    output directory), in a stable order.
+    """
+    digest = hashlib.sha256()
+    for name in sorted(outputs):
+        path = outputs[name]
+        if not isinstance(path, str) or not os.path.exists(path):
+            digest.update(f"{name}={path}".encode())
+            continue
+        files = [path] if os.path.isfile(path) else sorted(
+            os.path.join(root, f) for root, _, names in os.walk(path) for f in names)
+        for file in files:
+            digest.update(os.path.relpath(file, path).encode() if file != path else name.encode())
+            with open(file, "rb") as f:
+                for block in iter(lambda: f.read(1 << 20), b""):
+                    digest.update(block)
+    return digest.hexdigest()
+
+def stage_key(stage, config, digests):
+    """
+    Cache key of a stage: its name, the config values it reads, the content
+    digests of its dependencies' outputs and of the extra files it reads.
+    """
+    payload = {
+        'stage': stage.name,
+        'params': {p: config_value(config, p) for p in stage.params},
+        'deps': {d: digests[d] for d in stage.deps},
+    }
+    if stage.files:
+        payload['files'] = {}
+        for f in stage.files:
+            path = config_value(config, f)
+            payload['files'][f] = file_digest(path) if path and os.path.exists(path) else None
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+def _outputs_exist(outputs):
+    return all(os.path.exists(p) for p in outputs.values())
+
+def execute_stage(stage, config, inputs, profile_stage=None, profile_mode="cprofile"):
+    """
+    Runs one stage under its own RunReport (this may be a worker process).
+    Returns (outputs, output digest, report dict).
+    """
+    report = RunReport(stage.name, profile_stage=profile_stage, profile_mode=profile_mode,
+                       profile_dir=config['work_dir'])
+    with report:
+        with span(stage.name):
+            outputs = stage.func(config, inputs)
+    if stage.name == "clean":
+        digest = outputs['source_sha256']
+    else:
+        digest = output_digest(outputs)
+    return outputs, digest, report.to_dict()
+
+def _topological(stages):
+    names = {s.name for s in stages}
+    for s in stages:
+        missing = [d for d in s.deps if d not in names]
+        if missing:
+            raise ValueError(f"Stage '{s.name}' depends on unknown stage(s) {missing}")
+    return {s.name: s for s in stages}
+
+def run_pipeline(config, stages=STAGES, n_jobs=None, force=(), profile_stage=None, profile_mode="cprofile",
+                 report_path=None):
+    """
+    Runs the training DAG. Stages whose dependencies are done are started right
+    away, in up to n_jobs worker processes (n_jobs=1 runs everything in-process),
+    so the RFM/KMeans branch, product list and rule mining proceed concurrently.
+
+    A stage is skipped when its cache key (see stage_key) matches the one stored
+    in <work_dir>/manifest.json from its last successful run and its outputs still
+    exist; `force` lists stages to re-run regardless ("all" for every stage).
+    Returns the per-stage status dict, also written to report_path as JSON.
+    """
+    by_name = _topological(stages)
+    os.makedirs(config['work_dir'], exist_ok=True)
+    manifest_path = os.path.join(config['work_dir'], "manifest.json")
+    manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+
+    def save_manifest():
+        with open(manifest_path + ".tmp", "w") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(manifest_path + ".tmp", manifest_path)
+
+    outputs, digests, status = {}, {}, {}
+    pending = [s.name for s in stages]
+    running = {}
+    start = time.perf_counter()
+    pool = ProcessPoolExecutor(n_jobs) if n_jobs != 1 else None
+
+    def finish(name, key, result, seconds):
+        outputs[name], digests[name], report = result
+        if by_name[name].files:
+            # The stage may have rewritten its files (e.g. the rule state); key on what it left behind
+            key = stage_key(by_name[name], config, digests)
+        manifest[name] = {'key': key, 'outputs': outputs[name], 'digest': digests[name]}
+        save_manifest()
+        status[name] = {'status': "ran", 'seconds': seconds, 'key': key, 'report': report}
+        print(f"[{name}] done in {seconds:.2f}s")
+
+    try:
+        while pending or running:
+            for name in [n for n in pending if all(d in digests for d in by_name[n].deps)]:
+                stage = by_name[name]
+                pending.remove(name)
+                key = stage_key(stage, config, digests)
+                cached = manifest.get(name)
+                if not stage.always_run and "all" not in force and name not in force and cached \
+                        and cached['key'] == key and _outputs_exist(cached['outputs']):
+                    outputs[name], digests[name] = cached['outputs'], cached['digest']
+                    status[name] = {'status': "cached", 'seconds': 0.0, 'key': key}
+                    print(f"[{name}] unchanged, skipped")
+                    continue
+                inputs = {d: outputs[d] for d in stage.deps}
+                print(f"[{name}] running...")
+                if pool is None:
+                    stage_start = time.perf_counter()
+                    finish(name, key, execute_stage(stage, config, inputs, profile_stage, profile_mode),
+                           time.perf_counter() - stage_start)
+                else:
+                    future = pool.submit(execute_stage, stage, config, inputs, profile_stage, profile_mode)
+                    running[future] = (name, key, time.perf_counter())
+
+            if running:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name, key, stage_start = running.pop(future)
+                    finish(name, key, future.result(), time.perf_counter() - stage_start)
+            elif pending and not any(all(d in digests for d in by_name[n].deps) for n in pending):
+                raise RuntimeError(f"Pipeline stalled with stages {pending} pending")
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+
+    if report_path is not None:
+        with open(report_path + ".tmp", "w") as f:
+            json.dump({'seconds': time.perf_counter() - start, 'stages': status}, f, indent=2, default=str)
+        os.replace(report_path + ".tmp", report_path)
+    return status
@@ -1,106 +1,709 @@
 
 import pandas as pd
+import numpy as np
+import random
+from itertools import combinations
+import threading
+import time
+import tracemalloc
+from scipy import sparse
 from mlxtend.preprocessing import TransactionEncoder
 from mlxtend.frequent_patterns import fpgrowth, association_rules
 import joblib
 import os
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from core.artifacts import write_array_dir, read_array_dir
+from core.instrumentation import span, count
+from core.mining import (mine_frequent_itemsets, rules_from_itemsets, build_itemset_state,
+                         update_itemset_state, save_itemset_state, load_itemset_state)
 
-def generate_rules(df, min_support=0.01, min_threshold=0.3):
+# Columns generate_rules reads from the cleaned transactions
+RULE_INPUT_COLUMNS = ['invoiceno', 'description']
+
+def encode_transactions(df, items=None):
+    """
+    Integer-encodes the invoice/product pairs straight from the invoiceno and
+    description codes, without building per-invoice Python lists.
+    Returns (basket, items, invoices) where basket is a boolean CSR matrix of shape
+    (invoices, items) and items/invoices hold the column/row labels (sorted, like
+    TransactionEncoder). Passing an existing `items` vocabulary keeps its column
+    order and appends unseen products at the end.
+    """
+    inv_codes, invoices = pd.factorize(df['invoiceno'], sort=True)
+    descriptions = df['description'].astype(str)
+    if items is None:
+        item_codes, items = pd.factorize(descriptions, sort=True)
+    else:
+        items = pd.Index(items)
+        unseen = pd.Index(descriptions[~descriptions.isin(items)].unique()).sort_values()
+        items = items.append(unseen)
+        item_codes = items.get_indexer(descriptions)
+    n_invoices, n_items = len(invoices), len(items)
+
+    # One entry per (invoice, item) pair; sorting by invoice gives the CSR layout directly
+    pairs = np.unique(inv_codes.astype(np.int64) * n_items + item_codes)
+    row, col = np.divmod(pairs, n_items)
+    indptr = np.concatenate([[0], np.cumsum(np.bincount(row, minlength=n_invoices))])
+    basket = sparse.csr_matrix(
+        (np.ones(len(pairs), dtype=bool), col.astype(np.int32), indptr),
+        shape=(n_invoices, n_items)
+    )
+    return basket, items, invoices
+
+def estimate_basket_memory(n_invoices, n_items, avg_basket_size, n_frequent_items=None):
+    """
+    Rough peak size (bytes) of the basket encoding for each path.
+    dense:  TransactionEncoder array plus its boolean DataFrame copy, plus the
+            per-invoice Python lists it is built from.
+    sparse: CSR data/indices/indptr plus the factorized code arrays, plus the
+            frequent-item block mlxtend's fpgrowth densifies internally
+            (n_invoices x n_frequent_items; defaults to all items when unknown).
+    """
+    nnz = n_invoices * avg_basket_size
+    if n_frequent_items is None:
+        n_frequent_items = n_items
+    dense = 2 * n_invoices * n_items + n_invoices * 56 + nnz * 8
+    sparse_bytes = nnz * (1 + 4) + (n_invoices + 1) * 8 + nnz * 8 * 3 + n_invoices * n_frequent_items
+    return {'dense': dense, 'sparse': sparse_bytes}
+
+def max_invoices_for_budget(budget_bytes, n_items, avg_basket_size, encoding="sparse", n_frequent_items=None):
+    """
+    Largest invoice count whose basket encoding fits in budget_bytes (see estimate_basket_memory).
+    """
+    per_invoice = estimate_basket_memory(1, n_items, avg_basket_size, n_frequent_items)[encoding]
+    return int(budget_bytes // per_invoice)
+
+def generate_rules(df, min_support=0.01, min_threshold=0.3, encoding="dense", stats=None, engine="mlxtend", n_jobs=None,
+                   state_path=None, incremental=False):
     """
     Generates association rules from transaction data using FPGrowth for better performance.
+
+    encoding="sparse" builds a CSR basket from the factorized invoice/product codes,
+    drops items that can never reach min_support and hands fpgrowth a sparse
+    DataFrame, so the full dense invoice x product matrix is never built.
+    engine="native" mines the CSR basket with the in-project bitset Eclat miner
+    (core.mining) instead of mlxtend, splitting the search across n_jobs processes.
+    It always uses the sparse encoding and produces the same rules and metric columns.
+    If a dict is passed as `stats`, basket sizes and the peak traced memory of the
+    encoding step are written into it.
+
+    With a `state_path`, the native engine also persists item/itemset support counts
+    and the encoded history there. incremental=True then treats `df` as new invoices
+    only: they are merged into the saved state (see core.mining.update_itemset_state)
+    and rules are rebuilt from the updated counts without a full re-mine.
     """
+    if incremental:
+        return _generate_rules_incremental(df, min_support, min_threshold, state_path, stats)
+    if engine not in ("mlxtend", "native"):
+        raise ValueError(f"Unknown engine '{engine}', expected 'mlxtend' or 'native'")
+    if state_path is not None and engine != "native":
+        raise ValueError("state_path requires engine='native'")
+    if encoding not in ("dense", "sparse"):
+        raise ValueError(f"Unknown encoding '{encoding}', expected 'dense' or 'sparse'")
+
     # Ensure all descriptions are strings and handle potential nulls
     df['description'] = df['description'].astype(str)
     
-    invoice_grouped = df.groupby('invoiceno')['description'].apply(list).reset_index()
-    transactions = invoice_grouped['description'].tolist()
-    
-    te = TransactionEncoder()
-    te_array = te.fit(transactions).transform(transactions)
-    basket = pd.DataFrame(te_array, columns=te.columns_).astype(bool) # Force boolean
+    tracing = stats is not None and not tracemalloc.is_tracing()
+    if tracing:
+        tracemalloc.start()
+    if stats is not None:
+        tracemalloc.reset_peak()
+
+    with span("encode_baskets"):
+        if engine == "native" or encoding == "sparse":
+            matrix, items, invoices = encode_transactions(df)
+            n_items = len(items)
+            if engine == "mlxtend":
+                item_support = np.asarray(matrix.sum(axis=0)).ravel() / float(matrix.shape[0])
+                frequent = np.flatnonzero(item_support >= min_support)
+                matrix = matrix[:, frequent]
+                basket = pd.DataFrame.sparse.from_spmatrix(matrix, columns=items[frequent])
+            n_invoices = matrix.shape[0]
+            basket_nbytes = matrix.data.nbytes + matrix.indices.nbytes + matrix.indptr.nbytes
+        else:
+            invoice_grouped = df.groupby('invoiceno')['description'].apply(list).reset_index()
+            transactions = invoice_grouped['description'].tolist()
+        
+            te = TransactionEncoder()
+            te_array = te.fit(transactions).transform(transactions)
+            basket = pd.DataFrame(te_array, columns=te.columns_).astype(bool) # Force boolean
+            n_invoices = len(basket)
+            basket_nbytes = int(basket.memory_usage(index=False).sum())
+            n_items = len(te.columns_)
+    count("invoices", n_invoices)
+    count("items", n_items)
+
+    if stats is not None:
+        stats['n_invoices'] = n_invoices
+        stats['n_items'] = n_items
+        stats['basket_bytes'] = basket_nbytes
+        stats['peak_encoding_bytes'] = tracemalloc.get_traced_memory()[1]
+    if tracing:
+        tracemalloc.stop()
+
+    if engine == "native":
+        with span("mine_itemsets"):
+            if state_path is not None:
+                state = build_itemset_state(matrix, items, invoices, min_support, n_jobs=n_jobs)
+                save_itemset_state(state, state_path)
+                itemsets = state['itemsets']
+            else:
+                itemsets = mine_frequent_itemsets(matrix, min_support, n_jobs=n_jobs)
+            count("frequent_itemsets", len(itemsets))
+        if not itemsets:
+            return pd.DataFrame()
+        with span("association_rules"):
+            rules = rules_from_itemsets(itemsets, n_invoices, items, min_threshold)
+            count("rules", len(rules))
+        return rules.sort_values(['lift', 'confidence'], ascending=False)
     
     # Using FPGrowth instead of Apriori for memory efficiency
-    frequent_itemsets = fpgrowth(basket, min_support=min_support, use_colnames=True)
+    with span("fpgrowth"):
+        frequent_itemsets = fpgrowth(basket, min_support=min_support, use_colnames=True)
+        count("frequent_itemsets", len(frequent_itemsets))
     
     if frequent_itemsets.empty:
         return pd.DataFrame()
         
-    rules = association_rules(frequent_itemsets, metric="confidence", min_threshold=min_threshold)
+    with span("association_rules"):
+        rules = association_rules(frequent_itemsets, metric="confidence", min_threshold=min_threshold)
+        count("rules", len(rules))
     rules = rules.sort_values(['lift', 'confidence'], ascending=False)
     
     return rules
 
-def recommend_for_basket(basket_items, rules, top_n=5):
+def _generate_rules_incremental(df, min_support, min_threshold, state_path, stats=None):
+    """
+    Merges the invoices in df that the saved state has not seen yet and rebuilds
+    the rules from the updated itemset counts.
+    """
+    if state_path is None or not os.path.exists(state_path):
+        raise FileNotFoundError(f"No itemset state at {state_path}, run a full generate_rules with state_path first")
+    state = load_itemset_state(state_path)
+    if state['min_support'] != min_support:
+        raise ValueError(f"State was mined at min_support={state['min_support']}, "
+                         f"a different min_support ({min_support}) needs a full retrain")
+
+    df = df[~df['invoiceno'].isin(state['invoices'])].copy()
+    df['description'] = df['description'].astype(str)
+    with span("encode_baskets"):
+        matrix, items, invoices = encode_transactions(df, items=state['items'])
+    count("invoices", matrix.shape[0])
+    with span("update_itemsets"):
+        rescanned = update_itemset_state(state, matrix, items, invoices)
+        save_itemset_state(state, state_path)
+    count("rescanned_itemsets", rescanned)
+    count("frequent_itemsets", len(state['itemsets']))
+
+    if stats is not None:
+        stats['n_new_invoices'] = matrix.shape[0]
+        stats['n_invoices'] = state['history'].shape[0]
+        stats['n_items'] = len(state['items'])
+        stats['n_rescanned_itemsets'] = rescanned
+
+    if not state['itemsets']:
+        return pd.DataFrame()
+    with span("association_rules"):
+        rules = rules_from_itemsets(state['itemsets'], state['history'].shape[0], state['items'], min_threshold)
+        count("rules", len(rules))
+    return rules.sort_values(['lift', 'confidence'], ascending=False)
+
+def compact_rules(rules, min_lift=1.0, top_k=None, drop_redundant=True, stats=None):
+    """
+    Post-mining compaction of the served rule set:
+    1. Non-productive rules: lift <= min_lift (no better than chance by default).
+    2. Redundant rules (drop_redundant): X -> Y is dropped when a rule X' -> Y with
+       a strictly smaller antecedent X' in X has equal or higher confidence. Any
+       basket matching X also matches X', so the shorter rule already recommends Y
+       at least as strongly (minimal-antecedent rules).
+    3. With top_k, only the top_k rules (by confidence, then lift) per antecedent.
+    The input order is kept. If a dict is passed as `stats`, the number of rules
+    removed by each step is written into it.
+    """
+    n_rules = len(rules)
+    if rules.empty:
+        if stats is not None:
+            stats.update(rules_in=0, rules_out=0, low_lift=0, redundant=0, over_top_k=0)
+        return rules
+
+    with span("compact_rules"):
+        keep = (rules['lift'] > min_lift).to_numpy().copy()
+        low_lift = int((~keep).sum())
+
+        redundant = 0
+        if drop_redundant:
+            best = {}
+            for antecedent, consequent, confidence in zip(rules['antecedents'], rules['consequents'], rules['confidence']):
+                best[(antecedent, consequent)] = confidence
+            for i, (antecedent, consequent, confidence) in enumerate(
+                    zip(rules['antecedents'], rules['consequents'], rules['confidence'])):
+                if not keep[i] or len(antecedent) < 2:
+                    continue
+                items = sorted(antecedent)
+                subsets = (frozenset(c) for size in range(1, len(items)) for c in combinations(items, size))
+                if any(best.get((sub, consequent), -1.0) >= confidence for sub in subsets):
+                    keep[i] = False
+                    redundant += 1
+
+        compacted = rules[keep]
+        over_top_k = 0
+        if top_k is not None:
+            ranked = compacted[['antecedents', 'confidence', 'lift']].reset_index(drop=True) \
+                .sort_values(['confidence', 'lift'], ascending=False, kind='stable')
+            within = (ranked.groupby('antecedents', sort=False).cumcount() < top_k).to_numpy()
+            over_top_k = int((~within).sum())
+            compacted = compacted.iloc[np.sort(ranked.index.to_numpy()[within])]
+        count("rules_compacted", len(compacted))
+
+    if stats is not None:
+        stats.update(rules_in=n_rules, rules_out=len(compacted), low_lift=low_lift, redundant=redundant,
+                     over_top_k=over_top_k)
+    return compacted
+
+def normalize_item(item):
+    """
+    Canonical form used to compare product names (Upper and Strip).
+    """
+    return str(item).upper().strip()
+
+class RuleIndex:
+    """
+    Precompiled, integer-encoded view of an association rules DataFrame.
+
+    Item names are interned to integer IDs once, antecedents and consequents are
+    stored as CSR-style arrays and an inverted index maps every item to the rules
+    whose antecedents contain it. Basket lookups then only touch the postings of
+    the basket's items instead of scanning every rule.
+    The arrays are what save()/load() persist, so a served index never has to
+    rebuild the frozenset DataFrame.
+    """
+
+    GLOBAL_POOL_SIZE = 30
+    ARTIFACT_KIND = "rules"
+
+    def __init__(self, rules):
+        rules = rules.reset_index(drop=True)
+        names = {}
+        ant_indptr, ant_indices = [0], []
+        con_indptr, con_indices = [0], []
+        for antecedents, consequents in zip(rules['antecedents'], rules['consequents']):
+            ant_indices.extend(names.setdefault(item, len(names)) for item in antecedents)
+            ant_indptr.append(len(ant_indices))
+            con_indices.extend(names.setdefault(item, len(names)) for item in consequents)
+            con_indptr.append(len(con_indices))
+        self._build(list(names), ant_indptr, ant_indices, con_indptr, con_indices,
+                    rules.drop(columns=['antecedents', 'consequents']))
+
+    @classmethod
+    def from_arrays(cls, items, ant_indptr, ant_indices, con_indptr, con_indices, metrics):
+        index = cls.__new__(cls)
+        index._build(items, ant_indptr, ant_indices, con_indptr, con_indices, metrics)
+        return index
+
+    def _build(self, items, ant_indptr, ant_indices, con_indptr, con_indices, metrics):
+        self.items = list(items)
+        self.ant_indptr = np.asarray(ant_indptr, dtype=np.int64)
+        self.ant_indices = np.asarray(ant_indices, dtype=np.int32)
+        self.con_indptr = np.asarray(con_indptr, dtype=np.int64)
+        self.con_indices = np.asarray(con_indices, dtype=np.int32)
+        self.metrics = pd.DataFrame(metrics).reset_index(drop=True)
+        n_rules = len(self.metrics)
+
+        # Matching works on normalized names (Upper and Strip)
+        self.item_ids = {}
+        norm_of = np.fromiter((self.item_ids.setdefault(normalize_item(item), len(self.item_ids)) for item in self.items),
+                              dtype=np.int64, count=len(self.items))
+        n_norm = len(self.item_ids)
+
+        # Distinct normalized antecedent items per rule
+        rule_of_entry = np.repeat(np.arange(n_rules, dtype=np.int64), np.diff(self.ant_indptr))
+        pairs = np.unique(rule_of_entry * max(n_norm, 1) + norm_of[self.ant_indices])
+        pair_rule, pair_item = np.divmod(pairs, max(n_norm, 1))
+        self.ant_len = np.bincount(pair_rule, minlength=n_rules)
+        # Same pairs as a rule x item matrix, for matching many baskets with one sparse product
+        self.antecedent_matrix = sparse.csr_matrix(
+            (np.ones(len(pairs), dtype=np.int32), pair_item.astype(np.int32),
+             np.concatenate([[0], np.cumsum(self.ant_len)])),
+            shape=(n_rules, n_norm)
+        )
+
+        # Inverted index: item -> rules whose antecedents contain the item
+        order = np.argsort(pair_item, kind='stable')
+        self.postings = pair_rule[order].astype(np.int32)
+        counts = np.bincount(pair_item, minlength=n_norm)
+        self.postings_indptr = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+
+        self._con_ids = norm_of[self.con_indices].tolist()
+        self.con_names = [self.items[i] for i in self.con_indices.tolist()]
+
+        # Positions in the orderings used by each stage, so a matched subset can be
+        # ranked without re-sorting the DataFrame (pandas multi-key sorts are stable).
+        self.strict_rank = self._rank(['confidence', 'lift'])
+        self.partial_rank = self._rank(['lift', 'confidence'])
+        self.global_rules = self.metrics.sort_values('support', ascending=False).head(self.GLOBAL_POOL_SIZE).index.to_numpy()
+        # Fallback candidates of the global stage, computed once: (name, normalized id)
+        # of the top-support consequents, de-duplicated in first-seen order
+        self.global_pool = []
+        seen = set()
+        for r in self.global_rules.tolist():
+            for j in range(self.con_indptr[r], self.con_indptr[r + 1]):
+                if self.con_names[j] not in seen:
+                    seen.add(self.con_names[j])
+                    self.global_pool.append((self.con_names[j], self._con_ids[j]))
+
+    def __len__(self):
+        return len(self.metrics)
+
+    def _rank(self, by):
+        order = self.metrics.sort_values(by, ascending=False).index.to_numpy()
+        rank = np.empty(len(order), dtype=np.int64)
+        rank[order] = np.arange(len(order))
+        return rank
+
+    def to_frame(self, limit=None):
+        """
+        Rebuilds the rules DataFrame (frozenset antecedents/consequents plus the
+        metric columns), optionally only for the first `limit` rules.
+        """
+        n = len(self) if limit is None else min(limit, len(self))
+        def itemsets(indptr, indices):
+            return [frozenset(self.items[i] for i in indices[indptr[r]:indptr[r + 1]]) for r in range(n)]
+        frame = pd.DataFrame({
+            'antecedents': itemsets(self.ant_indptr, self.ant_indices),
+            'consequents': itemsets(self.con_indptr, self.con_indices),
+        })
+        return pd.concat([frame, self.metrics.iloc[:n].reset_index(drop=True)], axis=1)
+
+    def save(self, path):
+        """
+        Writes the versioned binary rules artifact (see core.artifacts): CSR
+        antecedent/consequent arrays over the item vocabulary plus one array
+        per metric column.
+        """
+        arrays = {
+            'ant_indptr': self.ant_indptr, 'ant_indices': self.ant_indices,
+            'con_indptr': self.con_indptr, 'con_indices': self.con_indices,
+        }
+        metric_names = list(self.metrics.columns)
+        for i, name in enumerate(metric_names):
+            arrays[f'metric_{i}'] = self.metrics[name].to_numpy(dtype=float)
+        write_array_dir(path, self.ARTIFACT_KIND, arrays, {'items': self.items, 'metrics': metric_names})
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """
+        Opens a rules artifact written by save(), memory-mapping its arrays.
+        """
+        meta, arrays = read_array_dir(path, cls.ARTIFACT_KIND, mmap=mmap)
+        metrics = pd.DataFrame({name: arrays[f'metric_{i}'] for i, name in enumerate(meta['metrics'])})
+        return cls.from_arrays(meta['items'], arrays['ant_indptr'], arrays['ant_indices'],
+                               arrays['con_indptr'], arrays['con_indices'], metrics)
+
+    def encode_basket(self, basket_items, normalized=False):
+        """
+        Maps basket items to the set of known item IDs. Unknown items cannot match any rule.
+        Pass normalized=True for names that are already normalized (for example
+        keys from core.catalog.ProductCatalog) to skip normalize_item.
+        """
+        if normalized:
+            ids = (self.item_ids.get(item) for item in basket_items)
+        else:
+            ids = (self.item_ids.get(normalize_item(item)) for item in basket_items)
+        return {i for i in ids if i is not None}
+
+    def match(self, basket_ids):
+        """
+        Returns (strict, partial) rule ids for an encoded basket.
+        Strict rules have antecedents that are a SUBSET of the basket, partial rules
+        share AT LEAST ONE antecedent item with it. Cost grows with the postings of
+        the basket items, not with the number of rules.
+        """
+        if not basket_ids:
+            empty = np.empty(0, dtype=np.int32)
+            return empty, empty
+        hits = np.concatenate([self.postings[self.postings_indptr[i]:self.postings_indptr[i + 1]] for i in basket_ids])
+        partial, overlap = np.unique(hits, return_counts=True)
+        strict = partial[overlap == self.ant_len[partial]]
+        return strict, partial
+
+    def consequents(self, rule_ids, basket_ids, limit=None, seen=None):
+        """
+        Walks rules in the given order and collects consequents that are not already
+        in the basket, de-duplicated and in first-seen order.
+        """
+        res = []
+        seen = set() if seen is None else set(seen)
+        for r in rule_ids:
+            for j in range(self.con_indptr[r], self.con_indptr[r + 1]):
+                item = self.con_names[j]
+                if self._con_ids[j] in basket_ids or item in seen:
+                    continue
+                seen.add(item)
+                res.append(item)
+                if limit is not None and len(res) >= limit:
+                    return res
+        return res
+
+    def encode_baskets(self, df):
+        """
+        Encodes invoice lines (invoiceno/description) as a CSR basket x item matrix
+        over this index's normalized item IDs. Products unknown to the rules are
+        dropped: they can neither match a rule nor be recommended.
+        Returns (matrix, keys) where keys holds the invoice number of each row.
+        """
+        rows, keys = pd.factorize(df['invoiceno'], sort=True)
+        items = df['description'].astype(str).str.upper().str.strip().map(self.item_ids)
+        known = items.notna().to_numpy()
+        n_items = max(len(self.item_ids), 1)
+        pairs = np.unique(rows[known].astype(np.int64) * n_items + items[known].to_numpy().astype(np.int64))
+        row, col = np.divmod(pairs, n_items)
+        matrix = sparse.csr_matrix(
+            (np.ones(len(pairs), dtype=np.int32), col.astype(np.int32),
+             np.concatenate([[0], np.cumsum(np.bincount(row, minlength=len(keys)))])),
+            shape=(len(keys), len(self.item_ids))
+        )
+        return matrix, keys
+
+    def recommend(self, basket_items, top_n=5, rng=random, normalized=False):
+        basket_ids = self.encode_basket(basket_items, normalized)
+        strict, partial = self.match(basket_ids)
+        return self.rank(basket_ids, strict, partial, top_n, rng)
+
+    def recommend_matrix(self, baskets, top_n=5, rng=random):
+        """
+        Recommendations for every row of a CSR basket x item matrix (see
+        encode_baskets). All baskets are matched at once: one sparse product with
+        the antecedent matrix gives each basket's overlap count per rule.
+        """
+        overlap = (sparse.csr_matrix(baskets, dtype=np.int32) @ self.antecedent_matrix.T).tocsr()
+        results = []
+        for i in range(baskets.shape[0]):
+            basket_ids = set(baskets.indices[baskets.indptr[i]:baskets.indptr[i + 1]].tolist())
+            partial = overlap.indices[overlap.indptr[i]:overlap.indptr[i + 1]]
+            counts = overlap.data[overlap.indptr[i]:overlap.indptr[i + 1]]
+            strict = partial[counts == self.ant_len[partial]]
+            results.append(self.rank(basket_ids, strict, partial, top_n, rng))
+        return results
+
+    def rank(self, basket_ids, strict, partial, top_n=5, rng=random):
+        """
+        Applies the strict -> partial -> global fallback to matched rule ids.
+        `rng` provides the shuffle used for diversity (the random module by default).
+        """
+        # --- Strategy 1: Strict Match ---
+        strict = strict[np.argsort(self.strict_rank[strict], kind='stable')]
+        recommendations = self.consequents(strict, basket_ids, limit=top_n + 4)
+
+        if len(recommendations) >= top_n + 4: # If we have plenty, we can shuffle a bit
+            pool = recommendations[:top_n + 4]
+            rng.shuffle(pool)
+            return pool[:top_n]
+
+        if len(recommendations) >= top_n:
+            return recommendations[:top_n]
+
+        # --- Strategy 2: Partial Match ---
+        partial = partial[np.argsort(self.partial_rank[partial], kind='stable')]
+        recommendations += self.consequents(partial, basket_ids, limit=top_n - len(recommendations), seen=recommendations)
+
+        if len(recommendations) >= top_n:
+            return recommendations[:top_n]
+
+        # --- Strategy 3: Global Diversity (Improved Fallback) ---
+        global_recs = [item for item, item_id in self.global_pool if item_id not in basket_ids]
+        rng.shuffle(global_recs)
+
+        for r in global_recs:
+            if r not in recommendations:
+                recommendations.append(r)
+                if len(recommendations) >= top_n:
+                    break
+
+        return recommendations[:top_n]
+
+def recommend_for_basket(basket_items, rules, top_n=5, random_state=None):
     """
     Returns recommendations with a 2-stage fallback strategy.
     1. Strict Match: Rules where Antecedents are SUBSET of Basket.
     2. Partial Match: Rules where Antecedents share AT LEAST ONE item with Basket.
+
+    `rules` may be the association rules DataFrame or a prebuilt RuleIndex.
+    Build the index once and reuse it when serving many baskets.
+    Pass `random_state` for a reproducible diversity shuffle.
+    """
+    index = rules if isinstance(rules, RuleIndex) else RuleIndex(rules)
+    rng = random if random_state is None else random.Random(random_state)
+    return index.recommend(basket_items, top_n=top_n, rng=rng)
+
+class RecommendationService:
+    """
+    Serving layer over a RuleIndex: deterministic recommendations plus an LRU
+    cache of recent baskets.
+
+    The diversity shuffle is seeded from `seed` and the basket itself, so the
+    same basket always gets the same recommendations (whatever the item order,
+    case or padding) and answers can be cached. Baskets are keyed on their
+    frozen set of normalized item IDs; entries expire after `ttl` seconds
+    (never if None) and the least recently used one is evicted beyond
+    `cache_size`. Safe to share between threads.
+    """
+
+    def __init__(self, rules, top_n=5, seed=0, cache_size=10_000, ttl=None):
+        self.index = rules if isinstance(rules, RuleIndex) else RuleIndex(rules)
+        self.top_n = top_n
+        self.seed = seed
+        self.cache_size = cache_size
+        self.ttl = ttl
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = self.expired = 0
+
+    def rng_for(self, key):
+        """
+        Random generator for the diversity step of one basket, seeded from the basket key.
+        """
+        return random.Random(f"{self.seed}:{','.join(map(str, sorted(key)))}")
+
+    def recommend(self, basket_items, top_n=None, normalized=False, match=None):
+        """
+        Recommendations for one basket. `match` may pass a (basket_ids, strict,
+        partial) triple already computed against this service's index (e.g. by
+        core.partitions.PartitionedRules.select) so the basket is not matched twice.
+        """
+        top_n = self.top_n if top_n is None else top_n
+        basket_ids = self.index.encode_basket(basket_items, normalized) if match is None else match[0]
+        key = (frozenset(basket_ids), top_n)
+        now = time.monotonic()
+
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is not None:
+                if self.ttl is None or now - entry[1] < self.ttl:
+                    self._cache.move_to_end(key)
+                    self.hits += 1
+                    return list(entry[0])
+                del self._cache[key]
+                self.expired += 1
+            self.misses += 1
+
+        strict, partial = self.index.match(basket_ids) if match is None else match[1:]
+        recs = self.index.rank(basket_ids, strict, partial, top_n, self.rng_for(key[0]))
+
+        if self.cache_size:
+            with self._lock:
+                self._cache[key] = (tuple(recs), now)
+                self._cache.move_to_end(key)
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+                    self.evictions += 1
+        return recs
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+    def stats(self):
+        """
+        Cache size and hit/miss/eviction counters.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._cache), 'capacity': self.cache_size,
+                'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions, 'expired': self.expired,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+_BATCH_INDEX = None
+
+def _init_batch(index):
+    global _BATCH_INDEX
+    _BATCH_INDEX = index
+
+def _recommend_chunk(task):
+    keys, baskets, top_n, seed = task
+    rng = random.Random(seed) if seed is not None else random
+    recs = _BATCH_INDEX.recommend_matrix(baskets, top_n=top_n, rng=rng)
+    return _long_format(keys, recs)
+
+def _long_format(keys, recs):
+    sizes = [len(r) for r in recs]
+    return pd.DataFrame({
+        'basket': np.repeat(np.asarray(keys, dtype=object), sizes),
+        'rank': np.concatenate([np.arange(1, n + 1) for n in sizes]) if recs else np.empty(0, dtype=int),
+        'item': [item for r in recs for item in r],
+    })
+
+def recommend_batch(baskets, rules, top_n=5, output_path=None, chunk_size=10_000, n_jobs=1, random_state=None):
+    """
+    Top-N recommendations for many baskets at once, with the same strict ->
+    partial -> global fallback as recommend_for_basket.
+
+    `baskets` is either a DataFrame of invoice lines (invoiceno/description) or a
+    (matrix, keys) pair where matrix is a CSR basket x item matrix over the
+    index's normalized item IDs (see RuleIndex.encode_baskets). Baskets are
+    matched chunk_size at a time with sparse matrix products, across n_jobs
+    worker processes when n_jobs > 1. `random_state` seeds the diversity shuffle
+    (per chunk, so results do not depend on n_jobs).
+
+    Results are long format (basket, rank, item). With an output_path they are
+    appended to that CSV chunk by chunk and the number of baskets is returned;
+    otherwise the DataFrame is returned.
+    """
+    index = rules if isinstance(rules, RuleIndex) else RuleIndex(rules)
+    if isinstance(baskets, pd.DataFrame):
+        matrix, keys = index.encode_baskets(baskets)
+    else:
+        matrix, keys = baskets
+        matrix = sparse.csr_matrix(matrix)
+
+    def tasks():
+        for chunk_id, start in enumerate(range(0, matrix.shape[0], chunk_size)):
+            seed = None if random_state is None else random_state + chunk_id
+            yield keys[start:start + chunk_size], matrix[start:start + chunk_size], top_n, seed
+
+    if output_path is not None and os.path.exists(output_path):
+        os.remove(output_path)
+    frames = []
+
+    def emit(frame):
+        if output_path is None:
+            frames.append(frame)
+        else:
+            frame.to_csv(output_path, mode='a', header=not os.path.exists(output_path), index=False)
+
+    if n_jobs == 1:
+        _init_batch(index)
+        for task in tasks():
+            emit(_recommend_chunk(task))
+    else:
+        # Bounded number of chunks in flight; results are emitted in input order
+        with ProcessPoolExecutor(n_jobs, initializer=_init_batch, initargs=(index,)) as pool:
+            pending = deque()
+            for task in tasks():
+                pending.append(pool.submit(_recommend_chunk, task))
+                if len(pending) >= 2 * n_jobs:
+                    emit(pending.popleft().result())
+            while pending:
+                emit(pending.popleft().result())
+
+    if output_path is not None:
+        return matrix.shape[0]
+    if not frames:
+        return _long_format([], [])
+    return pd.concat(frames, ignore_index=True)
+
+def save_rules(rules, filename="rules.pkl", save_dir="artifacts", compact=True):
+    """
+    Pickles the rules DataFrame and, with compact=True, also writes the binary
+    rules artifact (directory named after filename without extension) that
+    RuleIndex.load memory-maps at serve time.
     """
-    # Normalize basket items for comparison (Upper and Strip)
-    normalized_basket = {str(item).upper().strip() for item in basket_items}
-    # print(f"DEBUG: normalized_basket={normalized_basket}")
-    
-    recommendations = []
-    
-    def get_clean_consequents(rules_df):
-        res = []
-        for _, row in rules_df.iterrows():
-            for item in row['consequents']:
-                clean_item = str(item).upper().strip()
-                if clean_item not in normalized_basket:
-                    res.append(item)
-        return list(dict.fromkeys(res))
-
-    # --- Strategy 1: Strict Match ---
-    # We use the normalized_basket for matching since it's the most robust
-    strict_rules = rules[rules['antecedents'].apply(lambda x: {str(a).upper().strip() for a in x}.issubset(normalized_basket))]
-    strict_rules = strict_rules.sort_values(['confidence', 'lift'], ascending=False)
-    
-    recommendations.extend(get_clean_consequents(strict_rules))
-    recommendations = list(dict.fromkeys(recommendations))
-    
-    if len(recommendations) >= top_n + 4: # If we have plenty, we can shuffle a bit
-        import random
-        pool = recommendations[:top_n + 4]
-        random.shuffle(pool)
-        return pool[:top_n]
-    
-    if len(recommendations) >= top_n:
-        return recommendations[:top_n]
-        
-    # --- Strategy 2: Partial Match ---
-    def is_partial_match(antecedents):
-        clean_ants = {str(a).upper().strip() for a in antecedents}
-        return not clean_ants.isdisjoint(normalized_basket)
-        
-    partial_rules = rules[rules['antecedents'].apply(is_partial_match)]
-    partial_rules = partial_rules.sort_values(['lift', 'confidence'], ascending=False)
-    
-    new_recs = get_clean_consequents(partial_rules)
-    for r in new_recs:
-        if r not in recommendations:
-            recommendations.append(r)
-                
-    if len(recommendations) >= top_n:
-        # Shuffle the newly added ones for diversity if we have enough
-        return recommendations[:top_n]
-        
-    # --- Strategy 3: Global Diversity (Improved Fallback) ---
-    top_global = rules.sort_values('support', ascending=False).head(30)
-    global_recs = get_clean_consequents(top_global)
-    
-    import random
-    random.shuffle(global_recs)
-    
-    for r in global_recs:
-        if r not in recommendations:
-            recommendations.append(r)
-            if len(recommendations) >= top_n:
-                break
-                    
-    return recommendations[:top_n]
-
-def save_rules(rules, filename="rules.pkl", save_dir="artifacts"):
     if not os.path.exists(save_dir):
         os.makedirs(save_dir)
     joblib.dump(rules, os.path.join(save_dir, filename))
+    if compact and not rules.empty:
+        RuleIndex(rules).save(os.path.join(save_dir, os.path.splitext(filename)[0]))
@@ -2,29 +2,222 @@
 import pandas as pd
 import numpy as np
 from sklearn.preprocessing import StandardScaler
-from sklearn.cluster import KMeans
+from sklearn.cluster import KMeans, MiniBatchKMeans
+from sklearn.metrics import silhouette_score
+from threadpoolctl import threadpool_limits
+from core.artifacts import write_array_dir, read_array_dir
+from core.instrumentation import span, count
 import joblib
 import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 
-def calculate_rfm(df):
+# Columns calculate_rfm reads from the cleaned transactions
+RFM_INPUT_COLUMNS = ['customerid', 'invoiceno', 'invoicedate', 'total_price']
+
+def monetary_to_int(values):
+    """
+    Truncates spend sums to whole units. Sums are rounded to 6 decimals first so
+    that float summation order (single pass vs merged partial sums) cannot flip
+    a value such as 2085.9999999 vs 2086.0000001 to a different integer.
+    """
+    return np.trunc(np.round(np.asarray(values, dtype=float), 6)).astype(int)
+
+def calculate_rfm(df, as_of=None, extra_features=False):
     """
     Computes Recency, Frequency, and Monetary values for each customer.
+    Fully vectorized: a single groupby with built-in max/sum and a distinct count
+    over factorized (integer) invoice codes.
+    Recency is measured from `as_of` (defaults to the last invoice date).
+    With extra_features, tenure (days since first purchase) and average basket
+    value are added from the same pass.
     """
-    last_date = df["invoicedate"].max()
+    last_date = df["invoicedate"].max() if as_of is None else pd.Timestamp(as_of)
     
-    rfm = df.groupby('customerid').agg({
-        'invoicedate': lambda x: (last_date - x.max()).days,
-        'invoiceno': 'nunique',
-        'total_price': 'sum'
-    }).reset_index()
+    invoice_codes, _ = pd.factorize(df['invoiceno'])
+    columns = pd.DataFrame({
+        'customerid': df['customerid'].to_numpy(),
+        'invoicedate': df['invoicedate'].to_numpy(),
+        'invoice': invoice_codes,
+        'total_price': df['total_price'].to_numpy(),
+    })
+    aggregations = {
+        'last_purchase': ('invoicedate', 'max'),
+        'frequency': ('invoice', 'nunique'),
+        'monetary': ('total_price', 'sum'),
+    }
+    if extra_features:
+        aggregations['first_purchase'] = ('invoicedate', 'min')
+    agg = columns.groupby('customerid').agg(**aggregations)
     
-    rfm.columns = ['customerid', 'recency', 'frequency', 'monetary']
-    rfm["monetary"] = rfm["monetary"].astype(int)
+    rfm = pd.DataFrame({
+        'customerid': agg.index.to_numpy(),
+        'recency': (last_date - agg['last_purchase']).dt.days.to_numpy(),
+        'frequency': agg['frequency'].to_numpy(),
+        'monetary': monetary_to_int(agg['monetary']),
+    })
+    if extra_features:
+        rfm['tenure'] = (last_date - agg['first_purchase']).dt.days.to_numpy()
+        rfm['avg_basket_value'] = agg['monetary'].to_numpy() / agg['frequency'].to_numpy()
+    count("customers", len(rfm))
     return rfm
 
-def train_kmeans(rfm, n_clusters=5):
+def _hll_registers(customerids, invoices, precision):
+    """
+    HyperLogLog registers of the invoice numbers per customer, kept sparse as
+    (customerid, register, rank) rows with the max rank per register.
+    """
+    hashes = pd.util.hash_array(np.asarray(invoices, dtype=object))
+    register = (hashes >> np.uint64(64 - precision)).astype(np.int32)
+    rest = hashes << np.uint64(precision)
+    # Position of the first set bit in the remaining bits (bit length via frexp)
+    bit_length = np.frexp(rest.astype(np.float64))[1]
+    rank = np.where(rest == 0, 64 - precision + 1, 64 - bit_length + 1).astype(np.int8)
+    registers = pd.DataFrame({'customerid': np.asarray(customerids), 'register': register, 'rank': rank})
+    return registers.groupby(['customerid', 'register'], as_index=False)['rank'].max()
+
+def _hll_estimate(registers, precision):
+    m = 1 << precision
+    alpha = 0.7213 / (1 + 1.079 / m)
+    grouped = registers.assign(inverse=np.exp2(-registers['rank'].astype(float))).groupby('customerid')
+    filled = grouped.size()
+    zeros = m - filled
+    estimate = alpha * m * m / (grouped['inverse'].sum() + zeros)
+    # Linear counting is more accurate for small cardinalities (the common case here)
+    small = (estimate <= 2.5 * m) & (zeros > 0)
+    estimate[small] = m * np.log(m / zeros[small])
+    return estimate.round().astype(int)
+
+def rfm_partial(chunk, distinct="exact", precision=8):
+    """
+    Per-customer partial RFM state for one chunk of transactions: last purchase
+    date and spend sum, plus either the distinct (customer, invoice) pairs
+    (distinct="exact") or a HyperLogLog sketch with 2**precision registers per
+    customer (distinct="approx"). Partials are combined with merge_rfm_partials.
+    """
+    if distinct not in ("exact", "approx"):
+        raise ValueError(f"Unknown distinct mode '{distinct}', expected 'exact' or 'approx'")
+    customers = chunk.groupby('customerid').agg(last_purchase=('invoicedate', 'max'), monetary=('total_price', 'sum'))
+    if distinct == "exact":
+        invoices = chunk[['customerid', 'invoiceno']].drop_duplicates()
+    else:
+        invoices = _hll_registers(chunk['customerid'].to_numpy(), chunk['invoiceno'].to_numpy(), precision)
+    return {'distinct': distinct, 'precision': precision, 'customers': customers, 'invoices': invoices}
+
+def merge_rfm_partials(partials):
+    """
+    Combines partial states: max of last purchase, sum of spend, union of the
+    invoice pairs (or register-wise max of the sketches).
+    """
+    first = partials[0]
+    customers = pd.concat([p['customers'] for p in partials])
+    customers = customers.groupby(level=0).agg({'last_purchase': 'max', 'monetary': 'sum'})
+    invoices = pd.concat([p['invoices'] for p in partials], ignore_index=True)
+    if first['distinct'] == "exact":
+        invoices = invoices.drop_duplicates()
+    else:
+        invoices = invoices.groupby(['customerid', 'register'], as_index=False)['rank'].max()
+    return {'distinct': first['distinct'], 'precision': first['precision'], 'customers': customers, 'invoices': invoices}
+
+def calculate_rfm_chunked(chunks, as_of=None, distinct="exact", n_jobs=1, precision=8, merge_every=8):
+    """
+    Out-of-core calculate_rfm over an iterator of transaction chunks (for example
+    core.data_processing.iter_clean_chunks). Each chunk is reduced to a partial
+    state by rfm_partial, in n_jobs worker processes when n_jobs > 1, and partials
+    are merged every `merge_every` chunks to bound memory.
+    With distinct="exact" the result matches calculate_rfm on the concatenated data.
+    """
+    partials = []
+
+    def collect(partial):
+        partials.append(partial)
+        if len(partials) >= merge_every:
+            partials[:] = [merge_rfm_partials(partials)]
+
+    if n_jobs == 1:
+        for chunk in chunks:
+            collect(rfm_partial(chunk, distinct, precision))
+    else:
+        # Keep a bounded number of chunks in flight instead of letting map() read them all
+        with ProcessPoolExecutor(n_jobs) as pool:
+            pending = deque()
+            for chunk in chunks:
+                pending.append(pool.submit(rfm_partial, chunk, distinct, precision))
+                if len(pending) >= 2 * n_jobs:
+                    collect(pending.popleft().result())
+            while pending:
+                collect(pending.popleft().result())
+
+    if not partials:
+        return pd.DataFrame(columns=['customerid', 'recency', 'frequency', 'monetary'])
+    state = merge_rfm_partials(partials)
+    customers = state['customers'].sort_index()
+    last_date = customers['last_purchase'].max() if as_of is None else pd.Timestamp(as_of)
+
+    if distinct == "exact":
+        frequency = state['invoices'].groupby('customerid').size()
+    else:
+        frequency = _hll_estimate(state['invoices'], precision)
+
+    return pd.DataFrame({
+        'customerid': customers.index.to_numpy(),
+        'recency': (last_date - customers['last_purchase']).dt.days.to_numpy(),
+        'frequency': frequency.reindex(customers.index).to_numpy(),
+        'monetary': monetary_to_int(customers['monetary']),
+    })
+
+def make_kmeans(n_clusters, mode="full", batch_size=4096):
+    """
+    mode="full" is the original Lloyd KMeans; mode="minibatch" fits on random
+    mini-batches, which scales to millions of customers.
+    """
+    if mode == "full":
+        return KMeans(n_clusters=n_clusters, random_state=42)
+    if mode == "minibatch":
+        return MiniBatchKMeans(n_clusters=n_clusters, random_state=42, batch_size=batch_size, n_init=3)
+    raise ValueError(f"Unknown KMeans mode '{mode}', expected 'full' or 'minibatch'")
+
+_SWEEP_DATA = None
+
+def _init_sweep(rfm_scaled):
+    global _SWEEP_DATA
+    _SWEEP_DATA = rfm_scaled
+    # One BLAS/OpenMP thread per worker; the parallelism comes from the process pool
+    threadpool_limits(1)
+
+def _fit_k(task):
+    k, mode, batch_size, sample_size = task
+    kmeans = make_kmeans(k, mode, batch_size)
+    labels = kmeans.fit_predict(_SWEEP_DATA)
+    sample = min(sample_size, len(_SWEEP_DATA))
+    silhouette = silhouette_score(_SWEEP_DATA, labels, sample_size=sample, random_state=42)
+    return {'k': k, 'inertia': float(kmeans.inertia_), 'silhouette': float(silhouette)}
+
+def sweep_kmeans(rfm, k_values=range(2, 11), mode="minibatch", sample_size=10000, batch_size=4096, n_jobs=None):
+    """
+    Model-selection sweep: fits one model per k (in parallel worker processes) on
+    the scaled RFM matrix and reports inertia plus a silhouette score computed on
+    a random sample of sample_size customers.
+    Returns (results, best_k) where best_k has the highest silhouette score.
+    """
+    rfm_scaled = StandardScaler().fit_transform(rfm[['recency', 'frequency', 'monetary']])
+    tasks = [(k, mode, batch_size, sample_size) for k in k_values]
+    n_jobs = min(n_jobs or os.cpu_count() or 1, len(tasks))
+    if n_jobs == 1:
+        _init_sweep(rfm_scaled)
+        results = [_fit_k(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(n_jobs, initializer=_init_sweep, initargs=(rfm_scaled,)) as pool:
+            results = list(pool.map(_fit_k, tasks))
+    results = pd.DataFrame(results)
+    best_k = int(results.loc[results['silhouette'].idxmax(), 'k'])
+    return results, best_k
+
+def train_kmeans(rfm, n_clusters=5, mode="full", batch_size=4096):
     """
     Trains KMeans model on RFM data and assigns segments.
+    mode="minibatch" uses MiniBatchKMeans (see make_kmeans); pick n_clusters
+    with sweep_kmeans.
     Returns:
         rfm_with_clusters (pd.DataFrame)
         kmeans_model (KMeans)
@@ -32,11 +225,14 @@ def train_kmeans(rfm, n_clusters=5):
     """
     rfm_data = rfm[['recency', 'frequency', 'monetary']]
     
-    scaler = StandardScaler()
-    rfm_scaled = scaler.fit_transform(rfm_data)
+    with span("scale"):
+        scaler = StandardScaler()
+        rfm_scaled = scaler.fit_transform(rfm_data)
     
-    kmeans = KMeans(n_clusters=n_clusters, random_state=42)
-    rfm['cluster'] = kmeans.fit_predict(rfm_scaled)
+    with span("fit_kmeans"):
+        kmeans = make_kmeans(n_clusters, mode, batch_size)
+        rfm['cluster'] = kmeans.fit_predict(rfm_scaled)
+    count("kmeans_iterations", kmeans.n_iter_)
     
     # Auto-Labeling Logic
     # We want to map cluster IDs to meaningful names based on centroids.
@@ -63,14 +259,6 @@ def train_kmeans(rfm, n_clusters=5):
     # 2: 'Champions', 3: 'Loyal', 4: 'Big Spenders', 0: 'Low Value', 1: 'Lost'
     # Use mapping based on sorted order to be consistent roughly with "Value"
     
-    labels_map = {
-        sorted_clusters[0]: "Champions",
-        sorted_clusters[1]: "Loyal Customers",
-        sorted_clusters[2]: "Potential Loyalists", # Changed "Big Spenders (At Risk)" to standard term if slightly lower
-        sorted_clusters[3]: "At Risk",
-        sorted_clusters[4]: "Lost"
-    }
-    
     # Override with notebook specific names if needed, but dynamic is safer.
     # Let's stick to notebook names but apply them dynamically.
     notebook_names = ["Champions", "Loyal Customers", "Big Spenders", "Low Value Customers", "Lost Customers"]
@@ -90,7 +278,148 @@ def train_kmeans(rfm, n_clusters=5):
     
     return rfm, kmeans, scaler, final_mapping
 
+class SegmentScorer:
+    """
+    Serve-time segment assignment from the saved scaler, KMeans centroids and
+    cluster -> segment mapping. Scoring is a single vectorized nearest-centroid
+    computation on the scaled RFM vectors, with no estimator call per row.
+    The scorer also keeps running RFM state per customer, so a customer's segment
+    can be refreshed as each new invoice arrives instead of at the next retrain.
+    """
+
+    def __init__(self, scaler, centroids, segment_map, as_of=None):
+        self.mean = np.asarray(scaler.mean_, dtype=float)
+        self.scale = np.asarray(scaler.scale_, dtype=float)
+        self.centroids = np.asarray(centroids, dtype=float)
+        self.centroid_norms = (self.centroids ** 2).sum(axis=1)
+        self.labels = np.array([segment_map.get(i, f"Segment {i}") for i in range(len(self.centroids))], dtype=object)
+        self.as_of = None if as_of is None else pd.Timestamp(as_of)
+        # customerid -> [last purchase, frequency, spend], plus invoices seen since seeding
+        self.state = {}
+        self.seen_invoices = set()
+
+    @classmethod
+    def from_artifacts(cls, save_dir="artifacts", segments_path=None, as_of=None):
+        """
+        Loads scaler.pkl, kmeans_model.pkl and segment_map.pkl from save_dir.
+        Older artifact sets without segment_map.pkl fall back to the cluster ->
+        segment pairs recorded in the segments CSV.
+        """
+        scaler = joblib.load(os.path.join(save_dir, "scaler.pkl"))
+        kmeans = joblib.load(os.path.join(save_dir, "kmeans_model.pkl"))
+        map_path = os.path.join(save_dir, "segment_map.pkl")
+        if os.path.exists(map_path):
+            segment_map = joblib.load(map_path)
+        else:
+            segments = pd.read_csv(segments_path or os.path.join(save_dir, "rfm_segments.csv"), usecols=['cluster', 'segment'])
+            segment_map = segments.drop_duplicates('cluster').set_index('cluster')['segment'].to_dict()
+        return cls(scaler, kmeans.cluster_centers_, segment_map, as_of=as_of)
+
+    def predict_clusters(self, rfm_values, batch_size=100_000):
+        """
+        Nearest centroid for each (recency, frequency, monetary) row, in batches.
+        """
+        values = np.asarray(rfm_values, dtype=float).reshape(-1, 3)
+        clusters = np.empty(len(values), dtype=np.int32)
+        for start in range(0, len(values), batch_size):
+            scaled = (values[start:start + batch_size] - self.mean) / self.scale
+            # ||x - c||^2 without the per-row ||x||^2 term, which does not change the argmin
+            distances = self.centroid_norms - 2 * scaled @ self.centroids.T
+            clusters[start:start + batch_size] = distances.argmin(axis=1)
+        return clusters
+
+    def score(self, rfm_values):
+        """
+        Segment label for each (recency, frequency, monetary) row.
+        """
+        return self.labels[self.predict_clusters(rfm_values)]
+
+    def score_frame(self, rfm):
+        """
+        Returns a copy of an RFM DataFrame with cluster and segment columns.
+        """
+        rfm = rfm.copy()
+        rfm['cluster'] = self.predict_clusters(rfm[['recency', 'frequency', 'monetary']].to_numpy())
+        rfm['segment'] = self.labels[rfm['cluster'].to_numpy()]
+        return rfm
+
+    def seed(self, rfm, as_of):
+        """
+        Starts the running state from an RFM table computed as of `as_of`.
+        """
+        self.as_of = pd.Timestamp(as_of)
+        last_purchase = self.as_of - pd.to_timedelta(rfm['recency'].to_numpy(), unit="D")
+        self.state = {
+            cid: [last, int(freq), float(spend)]
+            for cid, last, freq, spend in zip(rfm['customerid'].tolist(), last_purchase, rfm['frequency'].tolist(), rfm['monetary'].tolist())
+        }
+        self.seen_invoices = set()
+
+    def update(self, customerid, invoiceno, invoicedate, amount):
+        """
+        Folds one invoice line into the customer's running RFM state and returns
+        the customer's refreshed segment. New customers start from scratch.
+        """
+        invoicedate = pd.Timestamp(invoicedate)
+        entry = self.state.setdefault(customerid, [invoicedate, 0, 0.0])
+        entry[0] = max(entry[0], invoicedate)
+        if (customerid, invoiceno) not in self.seen_invoices:
+            self.seen_invoices.add((customerid, invoiceno))
+            entry[1] += 1
+        entry[2] += float(amount)
+        if self.as_of is None or invoicedate > self.as_of:
+            self.as_of = invoicedate
+        return self.segment_of(customerid)
+
+    def rfm_of(self, customerid):
+        last_purchase, frequency, spend = self.state[customerid]
+        return [(self.as_of - last_purchase).days, frequency, int(monetary_to_int([spend])[0])]
+
+    def segment_of(self, customerid):
+        """
+        Current segment from the running state, or None for an unknown customer.
+        """
+        if customerid not in self.state:
+            return None
+        return self.score([self.rfm_of(customerid)])[0]
+
 def save_model(model, filename, save_dir="artifacts"):
     if not os.path.exists(save_dir):
         os.makedirs(save_dir)
     joblib.dump(model, os.path.join(save_dir, filename))
+
+def save_segments(rfm, filename="rfm_segments.csv", save_dir="artifacts", compact=True):
+    """
+    Writes the labeled RFM table as CSV and, with compact=True, as a columnar
+    binary artifact (directory named after filename without extension): one
+    array per column, with the segment names stored as integer codes.
+    """
+    if not os.path.exists(save_dir):
+        os.makedirs(save_dir)
+    rfm.to_csv(os.path.join(save_dir, filename), index=False)
+    if not compact:
+        return
+    arrays, categories = {}, {}
+    for col in rfm.columns:
+        if pd.api.types.is_numeric_dtype(rfm[col]):
+            arrays[col] = rfm[col].to_numpy()
+        else:
+            codes, uniques = pd.factorize(rfm[col])
+            arrays[col] = codes.astype(np.int16)
+            categories[col] = [str(u) for u in uniques]
+    write_array_dir(os.path.join(save_dir, os.path.splitext(filename)[0]), "segments", arrays,
+                    {'columns': list(rfm.columns), 'categories': categories})
+
+def load_segments(path, mmap=True):
+    """
+    Opens a segments artifact written by save_segments. Numeric columns are
+    memory-mapped; coded columns come back as pandas Categoricals.
+    """
+    meta, arrays = read_array_dir(path, "segments", mmap=mmap)
+    columns = {}
+    for col in meta['columns']:
+        if col in meta['categories']:
+            columns[col] = pd.Categorical.from_codes(arrays[col], categories=meta['categories'][col])
+        else:
+            columns[col] = arrays[col]
+    return pd.DataFrame(columns, copy=False)
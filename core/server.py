@@ -0,0 +1,425 @@
+import asyncio
+import json
+import os
+import signal
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from urllib.parse import urlsplit
+
+import joblib
+import pandas as pd
+
+from core.recommendation import RecommendationService, RuleIndex
+from core.rfm_model import SegmentScorer
+from core.analytics import SegmentStore
+from core.catalog import ProductCatalog
+from core.partitions import PartitionedRules
+
+class ServingEngine:
+    """
+    Everything a request needs, loaded once from the training artifacts:
+    - rules: the memory-mapped RuleIndex behind a RecommendationService, so
+      answers follow recommend_for_basket's strict -> partial -> global
+      fallback, are deterministic per basket and repeat baskets are cached;
+    - scorer: SegmentScorer over the saved scaler, KMeans centroids and
+      cluster -> segment map, for raw (recency, frequency, monetary) vectors;
+    - store (optional): SegmentStore for looking up known customers by ID;
+    - catalog (optional): ProductCatalog used to map display names to the
+      normalized keys the rule index matches on;
+    - partitions (optional): PartitionedRules, per-segment / per-window rule
+      sets (each behind its own RecommendationService) picked by the
+      customer's segment or the request date, with the global rules as fallback.
+    """
+
+    def __init__(self, rule_index, scorer, store=None, catalog=None, partitions=None, top_n=5, seed=0,
+                 cache_size=10_000):
+        self.service = RecommendationService(rule_index, top_n=top_n, seed=seed, cache_size=cache_size)
+        self.scorer = scorer
+        self.store = store
+        self.catalog = catalog
+        self.partitions = partitions
+        self.partition_services = {}
+        if partitions is not None:
+            self.partition_services = {key: RecommendationService(index, top_n=top_n, seed=seed, cache_size=cache_size)
+                                       for key, index in partitions.indexes.items()}
+
+    @classmethod
+    def load(cls, artifacts_dir="artifacts", serving_dir=None, **options):
+        """
+        Loads the rules and KMeans artifacts from artifacts_dir and the segment
+        store / product catalog from serving_dir (default: artifacts_dir), as
+        written by scripts/train.py.
+        """
+        serving_dir = serving_dir or artifacts_dir
+        rules_dir = os.path.join(artifacts_dir, "association_rules")
+        if os.path.exists(rules_dir):
+            rule_index = RuleIndex.load(rules_dir)
+        else:
+            rule_index = RuleIndex(joblib.load(os.path.join(artifacts_dir, "association_rules.pkl")))
+        scorer = SegmentScorer.from_artifacts(artifacts_dir, segments_path=os.path.join(serving_dir, "rfm_segments.csv"))
+
+        store_dir = os.path.join(serving_dir, "segment_store")
+        store = SegmentStore.load(store_dir) if os.path.exists(store_dir) else None
+        catalog_dir = os.path.join(serving_dir, "product_catalog")
+        catalog = ProductCatalog.load(catalog_dir) if os.path.exists(catalog_dir) else None
+        partitions_dir = os.path.join(artifacts_dir, "partitioned_rules")
+        partitions = PartitionedRules.load(partitions_dir) if os.path.exists(partitions_dir) else None
+        return cls(rule_index, scorer, store, catalog, partitions, **options)
+
+    def recommend(self, baskets, top_n=None, segment=None, customerid=None, when=None):
+        """
+        Recommendations for each basket (a list of product names). With a
+        segment (or a customer ID to look it up) and/or a date, baskets go to
+        the matching partition rule set where it has rules for them.
+        """
+        if customerid is not None and segment is None and self.store is not None:
+            profile = self.store.lookup(int(customerid))
+            segment = profile['segment'] if profile is not None else None
+        normalized = self.catalog is not None
+        if normalized:
+            baskets = [self.catalog.normalize(basket) for basket in baskets]
+        if self.partitions is None or (segment is None and when is None):
+            return [self.service.recommend(basket, top_n, normalized) for basket in baskets]
+        recs = []
+        for basket in baskets:
+            # The partition's match is reused, so each basket is matched once per rule set tried
+            key, _, match = self.partitions.select(basket, segment, when, normalized)
+            service = self.service if key is None else self.partition_services[key]
+            recs.append(service.recommend(basket, top_n, normalized, match=match))
+        return recs
+
+    def segment(self, customers=None, rfm=None):
+        """
+        Segments for known customer IDs (their stored profile, or None if the ID
+        is unknown) and/or for raw (recency, frequency, monetary) rows.
+        """
+        result = {}
+        if customers is not None:
+            if self.store is None:
+                raise LookupError("No segment store loaded; only 'rfm' scoring is available")
+            result['customers'] = [self.store.lookup(int(c)) for c in customers]
+        if rfm is not None:
+            result['segments'] = self.scorer.score(rfm).tolist() if len(rfm) else []
+        return result
+
+    def info(self):
+        return {
+            'rules': len(self.service.index),
+            'segments': [str(label) for label in self.scorer.labels],
+            'customers': len(self.store) if self.store is not None else None,
+            'products': len(self.catalog) if self.catalog is not None else None,
+            'partitions': sorted(self.partition_services),
+            'cache': self.service.stats(),
+        }
+
+# Engine of a worker process, set once per process by the pool initializer
+_WORKER_ENGINE = None
+
+def _init_worker(artifacts_dir, serving_dir, options):
+    global _WORKER_ENGINE
+    _WORKER_ENGINE = ServingEngine.load(artifacts_dir, serving_dir, **options)
+
+def _call_worker(method, kwargs):
+    return getattr(_WORKER_ENGINE, method)(**kwargs)
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+           413: "Payload Too Large", 431: "Request Header Fields Too Large", 500: "Internal Server Error",
+           503: "Service Unavailable"}
+
+class RecommendationServer:
+    """
+    Minimal asyncio HTTP/1.1 (keep-alive, JSON) front end over a ServingEngine.
+
+    The event loop only parses requests and writes responses; recommending and
+    scoring run in a worker pool: `workers` processes that each open the
+    (memory-mapped) artifacts once in their initializer, or with workers=0 a
+    single thread over the in-process engine. Batched requests are split into
+    chunks of `chunk_size` baskets that run on the workers concurrently, and at
+    most `max_in_flight` tasks are queued on the pool at a time.
+
+    Artifacts are loaded as a generation (engine + its pool). reload() builds
+    and warms up the next generation next to the running one and then swaps it
+    in with a single assignment. Every call holds the generation it runs on
+    (taken once it has a pool slot, or for the whole request when a batch is
+    split), and the old pool is shut down only when its last held call
+    returns, so requests waiting or running during a reload are never dropped.
+    A failed reload keeps serving the old generation.
+
+    Endpoints:
+    - GET  /health    artifact counts, generation and load time;
+    - POST /recommend {"items": [...]} or {"baskets": [[...], ...]}, optional "top_n",
+                      "segment" or "customerid" and "date" (partitioned rules);
+    - POST /segment   {"customerid": id}, {"customers": [ids]} and/or
+                      {"rfm": [r, f, m]} / {"rfm": [[r, f, m], ...]};
+    - POST /reload    reload the artifacts from disk (also on SIGHUP).
+    """
+
+    MAX_BODY = 8 * 1024 * 1024
+    MAX_TOP_N = 100
+
+    def __init__(self, artifacts_dir="artifacts", serving_dir=None, workers=2, chunk_size=256, max_in_flight=None,
+                 top_n=5, seed=0, cache_size=10_000):
+        self.artifacts_dir = artifacts_dir
+        self.serving_dir = serving_dir
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.max_in_flight = max_in_flight or 4 * max(workers, 1)
+        self.options = {'top_n': top_n, 'seed': seed, 'cache_size': cache_size}
+        self.generation = None
+        self.requests = self.errors = 0
+        self._reload_lock = None
+        self._slots = None
+
+    async def _load_generation(self, number):
+        loop = asyncio.get_running_loop()
+        engine = await loop.run_in_executor(
+            None, partial(ServingEngine.load, self.artifacts_dir, self.serving_dir, **self.options))
+        if self.workers > 0:
+            executor = ProcessPoolExecutor(self.workers, initializer=_init_worker,
+                                           initargs=(self.artifacts_dir, self.serving_dir, self.options))
+            # Start every worker (and load its artifacts) before taking traffic
+            try:
+                await asyncio.gather(*(loop.run_in_executor(executor, _call_worker, "info", {})
+                                       for _ in range(self.workers)))
+            except BaseException:
+                executor.shutdown(cancel_futures=True)
+                raise
+        else:
+            executor = ThreadPoolExecutor(1)
+        return {'number': number, 'engine': engine, 'executor': executor, 'loaded_at': time.time(),
+                'info': engine.info(), 'in_flight': 0}
+
+    async def start(self):
+        self._reload_lock = asyncio.Lock()
+        self._slots = asyncio.Semaphore(self.max_in_flight)
+        self.generation = await self._load_generation(1)
+
+    async def reload(self):
+        """
+        Loads the artifacts again and atomically switches to them.
+        """
+        async with self._reload_lock:
+            old = self.generation
+            new = await self._load_generation(old['number'] + 1)
+            self.generation = new
+            # Calls still holding the old generation finish on its pool; the last one shuts it down
+            if old['in_flight'] == 0:
+                old['executor'].shutdown(wait=False)
+            print(f"Reloaded artifacts (generation {new['number']}, {new['info']['rules']} rules)")
+            return self.health()
+
+    async def _reload_on_signal(self):
+        try:
+            await self.reload()
+        except Exception as e:
+            print(f"Reload failed, still serving generation {self.generation['number']}: {e}")
+
+    def _hold(self):
+        generation = self.generation
+        generation['in_flight'] += 1
+        return generation
+
+    def _release(self, generation):
+        generation['in_flight'] -= 1
+        if generation is not self.generation and generation['in_flight'] == 0:
+            generation['executor'].shutdown(wait=False)
+
+    async def run(self, method, pinned=None, **kwargs):
+        """
+        Runs one engine call on a worker pool: the generation `pinned` by the
+        caller (already held), else the current one once a pool slot is free.
+        """
+        loop = asyncio.get_running_loop()
+        async with self._slots:
+            generation = pinned or self._hold()
+            try:
+                if self.workers > 0:
+                    return await loop.run_in_executor(generation['executor'], _call_worker, method, kwargs)
+                engine = generation['engine']
+                return await loop.run_in_executor(generation['executor'], partial(getattr(engine, method), **kwargs))
+            finally:
+                if pinned is None:
+                    self._release(generation)
+
+    def health(self):
+        generation = self.generation
+        info = dict(generation['info'])
+        info.pop('cache', None)
+        return dict(info, status="ok", generation=generation['number'], loaded_at=generation['loaded_at'],
+                    workers=self.workers, requests=self.requests, errors=self.errors)
+
+    # --- Endpoints ---
+
+    async def recommend(self, body):
+        top_n = body.get('top_n')
+        if top_n is not None and (not isinstance(top_n, int) or not 1 <= top_n <= self.MAX_TOP_N):
+            raise HTTPError(400, f"'top_n' must be an integer between 1 and {self.MAX_TOP_N}")
+        context = {'top_n': top_n, 'segment': body.get('segment'), 'customerid': body.get('customerid'),
+                   'when': body.get('date')}
+        if context['segment'] is not None and not isinstance(context['segment'], str):
+            raise HTTPError(400, "'segment' must be a segment name")
+        if context['customerid'] is not None and (not isinstance(context['customerid'], int)
+                                                  or isinstance(context['customerid'], bool)):
+            raise HTTPError(400, "Customer IDs must be integers")
+        if context['when'] is not None:
+            try:
+                context['when'] = str(pd.Timestamp(context['when']).date())
+            except (TypeError, ValueError):
+                raise HTTPError(400, "'date' must be an ISO date")
+        if 'items' in body:
+            basket = _string_list(body['items'], "items")
+            return {'recommendations': (await self.run("recommend", baskets=[basket], **context))[0]}
+        if 'baskets' not in body or not isinstance(body['baskets'], list):
+            raise HTTPError(400, "Expected 'items' (one basket) or 'baskets' (a list of baskets)")
+        baskets = [_string_list(b, "baskets[]") for b in body['baskets']]
+        chunks = [baskets[start:start + self.chunk_size] for start in range(0, len(baskets), self.chunk_size)]
+        # All chunks of one request run on the same generation
+        generation = self._hold()
+        try:
+            parts = await asyncio.gather(*(self.run("recommend", pinned=generation, baskets=chunk, **context)
+                                           for chunk in chunks))
+        finally:
+            self._release(generation)
+        return {'recommendations': [recs for part in parts for recs in part]}
+
+    async def segment(self, body):
+        customers = body.get('customers')
+        if 'customerid' in body:
+            customers = [body['customerid']]
+        if customers is not None and (not isinstance(customers, list)
+                                      or not all(isinstance(c, int) and not isinstance(c, bool) for c in customers)):
+            raise HTTPError(400, "Customer IDs must be integers")
+        rfm = body.get('rfm')
+        single_rfm = isinstance(rfm, list) and len(rfm) == 3 and all(_is_number(v) for v in rfm)
+        if single_rfm:
+            rfm = [rfm]
+        if rfm is not None and (not isinstance(rfm, list) or not all(
+                isinstance(row, list) and len(row) == 3 and all(_is_number(v) for v in row) for row in rfm)):
+            raise HTTPError(400, "'rfm' must be [recency, frequency, monetary] or a list of such rows")
+        if customers is None and rfm is None:
+            raise HTTPError(400, "Expected 'customerid', 'customers' or 'rfm'")
+
+        try:
+            result = await self.run("segment", customers=customers, rfm=rfm)
+        except LookupError as e:
+            raise HTTPError(404, str(e))
+        if 'customerid' in body:
+            profile = result.pop('customers')[0]
+            if profile is None:
+                raise HTTPError(404, f"Unknown customer {body['customerid']}")
+            result['customer'] = profile
+        if single_rfm:
+            result['segment'] = result.pop('segments')[0]
+        return result
+
+    async def dispatch(self, method, path, body):
+        routes = {
+            ('GET', '/health'): lambda: self.health(),
+            ('POST', '/recommend'): lambda: self.recommend(body),
+            ('POST', '/segment'): lambda: self.segment(body),
+            ('POST', '/reload'): lambda: self.reload(),
+        }
+        handler = routes.get((method, path))
+        if handler is None:
+            if any(p == path for _, p in routes):
+                raise HTTPError(405, f"{method} not allowed on {path}")
+            raise HTTPError(404, f"No endpoint {path}")
+        result = handler()
+        return await result if asyncio.iscoroutine(result) else result
+
+    # --- HTTP ---
+
+    async def handle(self, reader, writer):
+        """
+        Serves the requests of one connection until it is closed (keep-alive).
+        """
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b"\r\n\r\n")
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    break
+                except asyncio.LimitOverrunError:
+                    await self._respond(writer, 431, {'error': "Request headers too large"}, False)
+                    break
+
+                request_line, *header_lines = head.decode("latin-1").rstrip("\r\n").split("\r\n")
+                try:
+                    method, target, version = request_line.split(" ", 2)
+                except ValueError:
+                    await self._respond(writer, 400, {'error': "Malformed request line"}, False)
+                    break
+                headers = {}
+                for line in header_lines:
+                    name, _, value = line.partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                keep_alive = version == "HTTP/1.1" and headers.get('connection', "").lower() != "close"
+
+                try:
+                    length = int(headers.get('content-length', 0))
+                except ValueError:
+                    length = -1
+                if not 0 <= length <= self.MAX_BODY:
+                    await self._respond(writer, 413 if length > 0 else 400, {'error': "Bad Content-Length"}, False)
+                    break
+                raw = await reader.readexactly(length) if length else b""
+
+                self.requests += 1
+                try:
+                    try:
+                        body = json.loads(raw) if raw else {}
+                    except ValueError as e:
+                        raise HTTPError(400, f"Invalid JSON: {e}")
+                    if not isinstance(body, dict):
+                        raise HTTPError(400, "Request body must be a JSON object")
+                    status, payload = 200, await self.dispatch(method, urlsplit(target).path, body)
+                except HTTPError as e:
+                    status, payload = e.status, {'error': str(e)}
+                except Exception as e: # keep serving; the error goes back to the client
+                    status, payload = 500, {'error': f"{type(e).__name__}: {e}"}
+                if status >= 400:
+                    self.errors += 1
+                await self._respond(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def _respond(self, writer, status, payload, keep_alive):
+        body = json.dumps(payload).encode()
+        head = (f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+                f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n"
+                f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+        writer.write(head.encode("latin-1") + body)
+        await writer.drain()
+
+    async def serve(self, host="127.0.0.1", port=8000):
+        await self.start()
+        server = await asyncio.start_server(self.handle, host, port)
+        loop = asyncio.get_running_loop()
+        if hasattr(signal, "SIGHUP"):
+            loop.add_signal_handler(signal.SIGHUP, lambda: asyncio.ensure_future(self._reload_on_signal()))
+        info = self.generation['info']
+        print(f"Serving {info['rules']} rules and {len(info['segments'])} segments on http://{host}:{port} "
+              f"({self.workers or 'in-process'} workers)")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.generation['executor'].shutdown(cancel_futures=True)
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+def _string_list(value, name):
+    if not isinstance(value, list) or not all(isinstance(item, str) for item in value):
+        raise HTTPError(400, f"'{name}' must be a list of product names")
+    return value
@@ -0,0 +1,111 @@
+import numpy as np
+import pandas as pd
+
+# Raw column layout of the Online Retail export that load_and_clean_data expects
+RAW_COLUMNS = ['InvoiceNo', 'StockCode', 'Description', 'Quantity', 'InvoiceDate', 'UnitPrice', 'CustomerID', 'Country']
+
+COLORS = ['RED', 'BLUE', 'PINK', 'WHITE', 'GREEN', 'IVORY', 'BLACK', 'VINTAGE', 'RETRO', 'PAISLEY']
+PRODUCTS = ['HEART T-LIGHT HOLDER', 'LUNCH BAG', 'JUMBO BAG', 'CAKE CASES', 'ALARM CLOCK', 'CHILDRENS APRON',
+            'HOT WATER BOTTLE', 'PARTY BUNTING', 'MUG', 'DOORMAT', 'GIFT WRAP', 'PICNIC BASKET', 'TEA SET',
+            'CANDLE', 'NAPKINS', 'STORAGE TIN', 'PHOTO FRAME', 'CUSHION COVER', 'PURSE', 'WALL CLOCK']
+COUNTRIES = ['United Kingdom', 'Germany', 'France', 'EIRE', 'Spain', 'Netherlands', 'Belgium', 'Switzerland']
+COUNTRY_WEIGHTS = [0.89, 0.025, 0.02, 0.018, 0.012, 0.012, 0.012, 0.011]
+
+def zipf_weights(n, exponent):
+    """
+    Normalized Zipf popularity: the item at rank r gets weight 1 / r**exponent.
+    """
+    weights = 1.0 / np.arange(1, n + 1) ** exponent
+    return weights / weights.sum()
+
+def product_catalog(n_items, seed=0):
+    """
+    Stock codes, descriptions and base unit prices for n_items products.
+    Descriptions follow the export's upper-case style; a few carry the trailing
+    whitespace the real data has.
+    """
+    rng = np.random.default_rng(seed)
+    names = [f"{COLORS[i % len(COLORS)]} {PRODUCTS[(i // len(COLORS)) % len(PRODUCTS)]}" for i in range(n_items)]
+    names = [name if i < len(COLORS) * len(PRODUCTS) else f"{name} {i // (len(COLORS) * len(PRODUCTS)) + 1}"
+             for i, name in enumerate(names)]
+    names = [name + " " if rng.random() < 0.05 else name for name in names]
+    return pd.DataFrame({
+        'stockcode': [str(20000 + i) for i in range(n_items)],
+        'description': names,
+        'unitprice': np.round(rng.lognormal(0.8, 0.7, n_items), 2),
+    })
+
+def make_retail_transactions(n_invoices, n_items=4000, n_customers=None, zipf_exponent=0.6, mean_basket_size=20,
+                             n_bundles=200, bundle_rate=0.3, missing_customer_rate=0.25, return_rate=0.02,
+                             duplicate_rate=0.01, seed=42):
+    """
+    Synthetic transaction lines shaped like the raw Online Retail export
+    (RAW_COLUMNS, date strings, missing customer IDs, returns and duplicate rows).
+
+    Item popularity is Zipfian and basket sizes are geometric around
+    mean_basket_size. To give the miner real patterns, a share (bundle_rate) of
+    baskets also contains one of n_bundles groups of 2-4 products bought
+    together. Customer activity is Zipfian as well, so a few customers place
+    many orders.
+    """
+    rng = np.random.default_rng(seed)
+    n_customers = n_customers or max(n_invoices // 5, 1)
+    catalog = product_catalog(n_items, seed)
+
+    # Basket contents: Zipfian picks plus optional bundles
+    sizes = rng.geometric(1.0 / mean_basket_size, n_invoices)
+    invoice_of_line = np.repeat(np.arange(n_invoices), sizes)
+    items = rng.choice(n_items, sizes.sum(), p=zipf_weights(n_items, zipf_exponent))
+
+    bundle_sizes = rng.integers(2, 5, n_bundles)
+    bundle_items = rng.choice(n_items, bundle_sizes.sum())
+    bundle_start = np.concatenate([[0], np.cumsum(bundle_sizes)])
+    with_bundle = np.flatnonzero(rng.random(n_invoices) < bundle_rate)
+    bundle_of = rng.choice(n_bundles, len(with_bundle), p=zipf_weights(n_bundles, 0.5))
+    extra_sizes = bundle_sizes[bundle_of]
+    extra_items = bundle_items[np.concatenate([np.arange(bundle_start[b], bundle_start[b + 1]) for b in bundle_of])] \
+        if len(bundle_of) else np.empty(0, dtype=int)
+    invoice_of_line = np.concatenate([invoice_of_line, np.repeat(with_bundle, extra_sizes)])
+    items = np.concatenate([items, extra_items])
+    order = np.argsort(invoice_of_line, kind='stable')
+    invoice_of_line, items = invoice_of_line[order], items[order]
+    n_lines = len(items)
+
+    # Invoice level attributes
+    customers = 12346 + rng.choice(n_customers, n_invoices, p=zipf_weights(n_customers, 0.8)).astype(float)
+    customers[rng.random(n_invoices) < missing_customer_rate] = np.nan
+    minutes = np.sort(rng.integers(0, 373 * 24 * 60, n_invoices))
+    dates = pd.Timestamp("2010-12-01 08:00") + pd.to_timedelta(minutes, unit="m")
+    date_strings = (dates.month.astype(str) + "/" + dates.day.astype(str) + "/" + dates.year.astype(str) + " "
+                    + dates.hour.astype(str) + ":" + pd.Index(dates.minute).astype(str).str.zfill(2))
+    countries = rng.choice(COUNTRIES, n_invoices, p=COUNTRY_WEIGHTS)
+    returns = rng.random(n_invoices) < return_rate
+    invoice_numbers = pd.Index(np.arange(536365, 536365 + n_invoices)).astype(str)
+    invoice_numbers = np.where(returns, "C" + invoice_numbers, invoice_numbers)
+
+    quantity = rng.geometric(0.25, n_lines)
+    quantity = np.where(returns[invoice_of_line], -quantity, quantity)
+    df = pd.DataFrame({
+        'InvoiceNo': invoice_numbers[invoice_of_line],
+        'StockCode': catalog['stockcode'].to_numpy()[items],
+        'Description': catalog['description'].to_numpy()[items],
+        'Quantity': quantity,
+        'InvoiceDate': np.asarray(date_strings)[invoice_of_line],
+        'UnitPrice': catalog['unitprice'].to_numpy()[items],
+        'CustomerID': customers[invoice_of_line],
+        'Country': countries[invoice_of_line],
+    })
+
+    if duplicate_rate:
+        duplicates = df.sample(frac=duplicate_rate, random_state=seed)
+        df = pd.concat([df, duplicates]).sort_index(kind='stable').reset_index(drop=True)
+    return df
+
+def write_retail_csv(path, n_invoices, **kwargs):
+    """
+    Writes make_retail_transactions output as a latin1 CSV (the encoding load_and_clean_data reads).
+    Returns the number of lines written.
+    """
+    df = make_retail_transactions(n_invoices, **kwargs)
+    df.to_csv(path, index=False, encoding="latin1")
+    return len(df)
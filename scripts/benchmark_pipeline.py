@@ -0,0 +1,153 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+# Add project root to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from core.synthetic import write_retail_csv
+from core.data_processing import load_and_clean_data
+from core.rfm_model import calculate_rfm, train_kmeans
+from core.recommendation import generate_rules, recommend_for_basket, RuleIndex
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def measure(func, repeat=1, memory=True):
+    """
+    Runs func `repeat` times and returns (result, stats): the best wall time in
+    seconds and, with memory, the peak traced allocation of one extra run under
+    tracemalloc (kept separate so tracing overhead does not skew the timings).
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - start)
+    stats = {'seconds': min(times), 'runs': times}
+    if memory:
+        tracemalloc.start()
+        func()
+        stats['peak_bytes'] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return result, stats
+
+def sample_baskets(df, n_baskets, max_items=4, seed=0):
+    """
+    Real-looking query baskets: the first few distinct products of randomly chosen invoices.
+    """
+    invoices = df['invoiceno'].drop_duplicates().sample(n=min(n_baskets, df['invoiceno'].nunique()), random_state=seed)
+    lines = df[df['invoiceno'].isin(invoices)].drop_duplicates(['invoiceno', 'description'])
+    return [group['description'].astype(str).head(max_items).tolist() for _, group in lines.groupby('invoiceno')]
+
+def time_recommendations(baskets, index, top_n=5):
+    latencies = np.empty(len(baskets))
+    for i, basket in enumerate(baskets):
+        start = time.perf_counter()
+        recommend_for_basket(basket, index, top_n=top_n)
+        latencies[i] = time.perf_counter() - start
+    return latencies
+
+def run_scale(n_invoices, args, work_dir):
+    print(f"--- {n_invoices:,} invoices ---")
+    csv_path = os.path.join(work_dir, f"retail_{n_invoices}.csv")
+    n_lines = write_retail_csv(csv_path, n_invoices, n_items=args.items, zipf_exponent=args.zipf, seed=args.seed)
+    stages = {}
+
+    def stage(name, func, repeat=args.repeat):
+        result, stats = measure(func, repeat=repeat, memory=not args.no_memory)
+        stages[name] = stats
+        peak = f", peak {stats['peak_bytes'] / 1e6:.1f} MB" if 'peak_bytes' in stats else ""
+        print(f"{name:>16}: {stats['seconds']:.3f}s{peak}")
+        return result
+
+    df = stage("load_clean", lambda: load_and_clean_data(csv_path))
+    rfm = stage("calculate_rfm", lambda: calculate_rfm(df))
+    stage("train_kmeans", lambda: train_kmeans(rfm, n_clusters=args.clusters))
+    rules = stage("generate_rules", lambda: generate_rules(df, args.min_support, args.min_threshold, encoding="sparse",
+                                                           engine=args.engine))
+    index = stage("rule_index", lambda: RuleIndex(rules))
+
+    baskets = sample_baskets(df, args.baskets, seed=args.seed)
+    latencies = stage("recommend", lambda: time_recommendations(baskets, index), repeat=1)
+    stages["recommend"].update({
+        'baskets': len(baskets),
+        'p50_us': float(np.percentile(latencies, 50) * 1e6),
+        'p99_us': float(np.percentile(latencies, 99) * 1e6),
+        'mean_us': float(latencies.mean() * 1e6),
+    })
+    print(f"{'':>16}  p50 {stages['recommend']['p50_us']:.0f}us, p99 {stages['recommend']['p99_us']:.0f}us")
+
+    os.remove(csv_path)
+    return {
+        'n_invoices': n_invoices, 'n_lines': n_lines, 'n_clean_lines': len(df),
+        'n_customers': len(rfm), 'n_rules': len(rules), 'stages': stages,
+    }
+
+def compare(results, baseline_path):
+    """
+    Prints per-stage time ratios against an earlier results file (same scales only).
+    """
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    old = {(s['n_invoices'], name): stats['seconds'] for s in baseline['scales'] for name, stats in s['stages'].items()}
+    print(f"\nCompared with {baseline.get('commit') or baseline_path}:")
+    for scale in results['scales']:
+        for name, stats in scale['stages'].items():
+            before = old.get((scale['n_invoices'], name))
+            if before:
+                print(f"{scale['n_invoices']:>10,} {name:>16}: {before:.3f}s -> {stats['seconds']:.3f}s "
+                      f"({stats['seconds'] / before:.2f}x)")
+
+def main():
+    parser = argparse.ArgumentParser(description="Time and memory-profile each pipeline stage on synthetic Online Retail data.")
+    parser.add_argument("--scales", type=int, nargs="+", default=[5_000, 20_000, 100_000], help="Invoices per run")
+    parser.add_argument("--items", type=int, default=4000, help="Catalog size")
+    parser.add_argument("--zipf", type=float, default=0.6, help="Zipf exponent of item popularity")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--min-support", type=float, default=0.005)
+    parser.add_argument("--min-threshold", type=float, default=0.2)
+    parser.add_argument("--engine", choices=["native", "mlxtend"], default="native")
+    parser.add_argument("--clusters", type=int, default=5)
+    parser.add_argument("--baskets", type=int, default=1000, help="Baskets timed through recommend_for_basket")
+    parser.add_argument("--repeat", type=int, default=1, help="Timed runs per stage (best is reported)")
+    parser.add_argument("--no-memory", action="store_true", help="Skip the tracemalloc pass")
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--compare", help="Earlier results file to compare against")
+    args = parser.parse_args()
+
+    results = {
+        'commit': git_commit(),
+        'timestamp': pd.Timestamp.now(tz="UTC").isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'versions': {'numpy': np.__version__, 'pandas': pd.__version__},
+        'config': vars(args),
+        'scales': [],
+    }
+    with tempfile.TemporaryDirectory() as work_dir:
+        for n_invoices in args.scales:
+            results['scales'].append(run_scale(n_invoices, args, work_dir))
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
+    if args.compare:
+        compare(results, args.compare)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+# Add project root to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from core.rfm_model import calculate_rfm
+
+def legacy_calculate_rfm(df):
+    """
+    The previous per-customer lambda implementation, kept as the baseline.
+    """
+    last_date = df["invoicedate"].max()
+
+    rfm = df.groupby('customerid').agg({
+        'invoicedate': lambda x: (last_date - x.max()).days,
+        'invoiceno': 'nunique',
+        'total_price': 'sum'
+    }).reset_index()
+
+    rfm.columns = ['customerid', 'recency', 'frequency', 'monetary']
+    rfm["monetary"] = rfm["monetary"].astype(int)
+    return rfm
+
+def make_transactions(n_rows, rows_per_invoice=20, rows_per_customer=250, seed=42):
+    """
+    Transaction lines shaped like the cleaned Online Retail data (only the RFM columns).
+    """
+    rng = np.random.default_rng(seed)
+    n_invoices = max(n_rows // rows_per_invoice, 1)
+    n_customers = max(n_rows // rows_per_customer, 1)
+
+    invoice = np.sort(rng.integers(0, n_invoices, n_rows))
+    invoice_customer = rng.integers(12346, 12346 + n_customers, n_invoices)
+    minutes = np.sort(rng.integers(0, 373 * 24 * 60, n_invoices))
+    return pd.DataFrame({
+        'customerid': invoice_customer[invoice],
+        'invoiceno': (536365 + invoice).astype(str).astype(object),
+        'invoicedate': pd.Timestamp("2010-12-01") + pd.to_timedelta(minutes[invoice], unit="m"),
+        'total_price': np.round(rng.gamma(2.0, 8.0, n_rows), 2),
+    })
+
+def time_call(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark calculate_rfm against the legacy lambda implementation.")
+    parser.add_argument("--rows", type=int, nargs="+", default=[1_000_000, 10_000_000, 50_000_000])
+    parser.add_argument("--legacy-max-rows", type=int, default=50_000_000,
+                        help="Skip the (slow) legacy baseline above this many rows")
+    args = parser.parse_args()
+
+    print(f"{'rows':>12} {'customers':>10} {'legacy s':>10} {'vectorized s':>13} {'speedup':>8}  match")
+    for n_rows in args.rows:
+        df = make_transactions(n_rows)
+        rfm, fast = time_call(calculate_rfm, df)
+        if n_rows <= args.legacy_max_rows:
+            expected, slow = time_call(legacy_calculate_rfm, df)
+            match = "yes" if expected.equals(rfm) else "NO"
+            print(f"{n_rows:>12,} {len(rfm):>10,} {slow:>10.2f} {fast:>13.2f} {slow / fast:>7.1f}x  {match}")
+        else:
+            print(f"{n_rows:>12,} {len(rfm):>10,} {'-':>10} {fast:>13.2f} {'-':>8}  -")
+        del df
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+# Add project root to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from core.data_processing import load_and_clean_data
+from core.recommendation import generate_rules
+from core.mining import RULE_COLUMNS
+
+def sample_invoices(df, fraction, seed):
+    invoices = df['invoiceno'].drop_duplicates().sample(frac=fraction, random_state=seed)
+    return df[df['invoiceno'].isin(invoices)].copy()
+
+def compare_rules(expected, actual):
+    """
+    Returns a list of human readable differences between two rule DataFrames,
+    matching rules on (antecedents, consequents) and metrics with np.isclose.
+    """
+    if expected.empty and actual.empty:
+        return []
+    key = ['antecedents', 'consequents']
+    merged = expected.merge(actual, on=key, how='outer', suffixes=('_mlxtend', '_native'), indicator=True)
+    problems = []
+    missing = merged[merged['_merge'] != 'both']
+    if not missing.empty:
+        problems.append(f"{len(missing)} rules only found by one engine")
+    both = merged[merged['_merge'] == 'both']
+    for col in RULE_COLUMNS[2:]:
+        a, b = both[f'{col}_mlxtend'].to_numpy(float), both[f'{col}_native'].to_numpy(float)
+        bad = ~np.isclose(a, b, equal_nan=True)
+        if bad.any():
+            problems.append(f"{bad.sum()} rules differ in '{col}'")
+    return problems
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the native miner against mlxtend on sampled invoices.")
+    parser.add_argument("data", help="Path to the raw transactions CSV")
+    parser.add_argument("--fraction", type=float, default=0.2, help="Share of invoices per sample")
+    parser.add_argument("--samples", type=int, default=3)
+    parser.add_argument("--min-support", type=float, default=0.005)
+    parser.add_argument("--min-threshold", type=float, default=0.2)
+    parser.add_argument("--n-jobs", type=int, default=None)
+    args = parser.parse_args()
+
+    df = load_and_clean_data(args.data)
+    failed = False
+    for seed in range(args.samples):
+        sample = sample_invoices(df, args.fraction, seed)
+
+        start = time.perf_counter()
+        expected = generate_rules(sample, args.min_support, args.min_threshold, encoding="sparse")
+        mlxtend_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        actual = generate_rules(sample, args.min_support, args.min_threshold, engine="native", n_jobs=args.n_jobs)
+        native_time = time.perf_counter() - start
+
+        problems = compare_rules(expected, actual)
+        status = "OK" if not problems else "MISMATCH"
+        print(f"[{status}] sample {seed}: {sample['invoiceno'].nunique()} invoices, "
+              f"{len(expected)} rules, mlxtend {mlxtend_time:.2f}s, native {native_time:.2f}s")
+        for problem in problems:
+            print(f"    {problem}")
+        failed = failed or bool(problems)
+
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+import argparse
+import asyncio
+import multiprocessing
+import os
+import sys
+
+import numpy as np
+
+# Add project root to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from core.pipeline import load_config
+from core.recommendation import RuleIndex
+from core.server import RecommendationServer
+
+async def check(server, baskets, n_requests, n_reloads, batch_size):
+    """
+    Keeps n_requests recommend calls queued on the server's worker pool while
+    reloading n_reloads times. Returns (errors, wrong answers, final generation,
+    worker processes left over from retired generations).
+    """
+    await server.start()
+    expected = (await server.recommend({'baskets': baskets}))['recommendations']
+
+    async def request(i):
+        start = (i * batch_size) % len(baskets)
+        batch = [baskets[(start + j) % len(baskets)] for j in range(batch_size)]
+        body = {'items': batch[0]} if batch_size == 1 else {'baskets': batch}
+        result = (await server.recommend(body))['recommendations']
+        result = [result] if batch_size == 1 else result
+        return [expected[(start + j) % len(baskets)] for j in range(batch_size)] == result
+
+    async def reloads():
+        for _ in range(n_reloads):
+            await asyncio.sleep(0.05)
+            await server.reload()
+
+    try:
+        results = await asyncio.gather(*(request(i) for i in range(n_requests)), reloads(), return_exceptions=True)
+        # Retired pools shut down once drained; give their workers a moment to exit
+        await asyncio.sleep(1)
+        leftover = len(multiprocessing.active_children()) - server.workers
+    finally:
+        server.generation['executor'].shutdown(cancel_futures=True)
+    answers = results[:-1]
+    errors = [r for r in results if isinstance(r, BaseException)]
+    wrong = sum(1 for r in answers if r is False)
+    return errors, wrong, server.generation['number'], leftover
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that reloading the server's artifacts does not drop queued requests.")
+    parser.add_argument("--config", help="Training config (JSON) whose artifacts_dir/serving_dir to serve")
+    parser.add_argument("--set", dest="overrides", action="append", default=[], metavar="KEY=VALUE",
+                        help="Override one setting, e.g. --set artifacts_dir=artifacts (repeatable)")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--reloads", type=int, default=5)
+    parser.add_argument("--batch-size", type=int, default=1, help="Baskets per request")
+    args = parser.parse_args()
+
+    config = load_config(args.config, args.overrides)
+    # A small in-flight limit keeps most requests waiting on the server while it reloads
+    server = RecommendationServer(config['artifacts_dir'], config['serving_dir'], workers=args.workers,
+                                  max_in_flight=2)
+    items = RuleIndex.load(os.path.join(config['artifacts_dir'], "association_rules")).items
+    rng = np.random.default_rng(0)
+    baskets = [[items[i] for i in rng.choice(len(items), 3, replace=False).tolist()] for _ in range(500)]
+
+    errors, wrong, generation, leftover = asyncio.run(
+        check(server, baskets, args.requests, args.reloads, args.batch_size))
+    failed = bool(errors) or wrong > 0 or generation != args.reloads + 1 or leftover > 0
+    print(f"[{'MISMATCH' if failed else 'OK'}] {args.requests} requests across {args.reloads} reloads "
+          f"(final generation {generation}): {len(errors)} errors, {wrong} wrong answers, "
+          f"{max(leftover, 0)} workers of retired pools still running")
+    for error in errors[:5]:
+        print(f"    {type(error).__name__}: {error}")
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+import argparse
+import os
+import sys
+
+import pandas as pd
+
+# Add project root to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from core.data_processing import load_cached_dataset
+from core.recommendation import generate_rules, compact_rules
+from core.evaluation import time_split, holdout_queries, evaluate
+
+def main():
+    parser = argparse.ArgumentParser(description="Compact mined rules and compare held-out hit rate and latency.")
+    parser.add_argument("data", help="Path to the raw transactions CSV")
+    parser.add_argument("--min-support", type=float, default=0.005)
+    parser.add_argument("--min-threshold", type=float, default=0.2)
+    parser.add_argument("--min-lift", type=float, default=1.0)
+    parser.add_argument("--top-k", type=int, default=None, help="Rules kept per antecedent")
+    parser.add_argument("--keep-redundant", action="store_true", help="Skip the minimal-antecedent pruning")
+    parser.add_argument("--test-fraction", type=float, default=0.2, help="Latest share of invoices held out")
+    parser.add_argument("--queries", type=int, default=5000)
+    parser.add_argument("--top-n", type=int, default=5)
+    args = parser.parse_args()
+
+    df = load_cached_dataset(args.data, columns=['invoiceno', 'description', 'invoicedate'])
+    train, test = time_split(df, args.test_fraction)
+    print(f"Mining rules on {train['invoiceno'].nunique()} invoices...")
+    rules = generate_rules(train[['invoiceno', 'description']].copy(), args.min_support, args.min_threshold,
+                           encoding="sparse", engine="native")
+
+    stats = {}
+    compacted = compact_rules(rules, min_lift=args.min_lift, top_k=args.top_k, drop_redundant=not args.keep_redundant,
+                              stats=stats)
+    print(f"Rules: {stats['rules_in']} -> {stats['rules_out']} "
+          f"({1 - stats['rules_out'] / max(stats['rules_in'], 1):.1%} smaller; lift <= {args.min_lift}: {stats['low_lift']}, "
+          f"redundant: {stats['redundant']}, over top-k: {stats['over_top_k']})")
+
+    queries = holdout_queries(test, max_queries=args.queries)
+    results = pd.DataFrame([
+        dict(rule_set="mined", **evaluate(rules, queries, args.top_n)),
+        dict(rule_set="compacted", **evaluate(compacted, queries, args.top_n)),
+    ])
+    print(f"Held-out evaluation on {len(queries)} queries:")
+    print(results.to_string(index=False))
+
+if __name__ == "__main__":
+    main()
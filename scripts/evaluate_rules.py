@@ -0,0 +1,68 @@
+import argparse
+import os
+import sys
+
+import joblib
+import pandas as pd
+
+# Add project root to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from core.data_processing import load_cached_dataset
+from core.recommendation import generate_rules, RuleIndex
+from core.evaluation import time_split, holdout_queries, evaluate, sweep_thresholds, cheapest_within
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline evaluation of association rules on held-out invoices.")
+    parser.add_argument("data", help="Path to the raw transactions CSV")
+    parser.add_argument("--rules", help="Evaluate this rules pickle or compact rules directory instead of mining")
+    parser.add_argument("--min-support", type=float, default=0.005)
+    parser.add_argument("--min-threshold", type=float, default=0.2)
+    parser.add_argument("--sweep", action="store_true",
+                        help="Evaluate every --supports x --thresholds combination from one mining pass")
+    parser.add_argument("--supports", type=float, nargs="+", default=[0.003, 0.005, 0.01, 0.02])
+    parser.add_argument("--thresholds", type=float, nargs="+", default=[0.1, 0.2, 0.3, 0.5])
+    parser.add_argument("--tolerance", type=float, default=0.005,
+                        help="Sweep: allowed hit-rate loss when picking the smallest rule set")
+    parser.add_argument("--test-fraction", type=float, default=0.2, help="Latest share of invoices held out")
+    parser.add_argument("--hidden", type=int, default=1, help="Products hidden per held-out invoice")
+    parser.add_argument("--queries", type=int, default=20000, help="Maximum number of held-out queries")
+    parser.add_argument("--top-n", type=int, default=5)
+    parser.add_argument("--n-jobs", type=int, default=None)
+    parser.add_argument("--output", help="Write the results as CSV")
+    args = parser.parse_args()
+
+    df = load_cached_dataset(args.data, columns=['invoiceno', 'description', 'invoicedate'])
+    train, test = time_split(df, args.test_fraction)
+    queries = holdout_queries(test, n_hidden=args.hidden, max_queries=args.queries)
+    print(f"{train['invoiceno'].nunique()} training invoices, {len(queries)} held-out queries")
+    cutoffs = sorted({1, 3, args.top_n} & set(range(1, args.top_n + 1)))
+
+    if args.sweep:
+        results = sweep_thresholds(train, queries, args.supports, args.thresholds, top_n=args.top_n,
+                                   n_jobs=args.n_jobs, cutoffs=cutoffs)
+        print(f"Mined {results.attrs['mined_itemsets']} itemsets at min_support={results.attrs['mining_support']} "
+              f"in {results.attrs['mining_seconds']:.2f}s")
+        print(results.to_string(index=False))
+        best = cheapest_within(results, f'hit_rate@{args.top_n}', args.tolerance)
+        if best is not None:
+            print(f"Cheapest rule set within {args.tolerance} of the best hit rate: "
+                  f"min_support={best['min_support']}, min_threshold={best['min_threshold']} "
+                  f"({int(best['rules'])} rules, hit_rate@{args.top_n}={best[f'hit_rate@{args.top_n}']:.4f})")
+    else:
+        if args.rules:
+            rules = RuleIndex.load(args.rules) if os.path.isdir(args.rules) else joblib.load(args.rules)
+        else:
+            rules = generate_rules(train[['invoiceno', 'description']].copy(), args.min_support, args.min_threshold,
+                                   encoding="sparse", engine="native", n_jobs=args.n_jobs)
+        metrics = evaluate(rules, queries, top_n=args.top_n, n_jobs=args.n_jobs, cutoffs=cutoffs)
+        for name, value in metrics.items():
+            print(f"{name:>22}: {value:.4f}" if isinstance(value, float) else f"{name:>22}: {value}")
+        results = pd.DataFrame([metrics])
+
+    if args.output:
+        results.to_csv(args.output, index=False)
+        print(f"Results written to {args.output}")
+
+if __name__ == "__main__":
+    main()
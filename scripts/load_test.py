@@ -0,0 +1,127 @@
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from urllib.parse import urlsplit
+
+import numpy as np
+
+# Add project root to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from core.artifacts import read_array_dir
+from core.recommendation import RuleIndex
+
+def make_payloads(args, rng):
+    """
+    Pre-built request bodies, cycled through by the clients. Baskets draw items
+    from the rules artifact's vocabulary, so most of them match some rule.
+    """
+    if args.endpoint == "segment":
+        rows = np.column_stack([rng.integers(0, 400, args.distinct), rng.integers(1, 50, args.distinct),
+                                rng.integers(10, 20_000, args.distinct)]).tolist()
+        return [json.dumps({'rfm': rows[i:i + args.batch_size]}).encode()
+                for i in range(0, len(rows) - args.batch_size + 1, args.batch_size)]
+    meta, _ = read_array_dir(args.rules, RuleIndex.ARTIFACT_KIND, mmap=True)
+    items = meta['items']
+    baskets = [[items[i] for i in rng.choice(len(items), min(args.basket_size, len(items)), replace=False).tolist()]
+               for _ in range(args.distinct)]
+    if args.batch_size == 1:
+        return [json.dumps({'items': basket}).encode() for basket in baskets]
+    return [json.dumps({'baskets': baskets[i:i + args.batch_size]}).encode()
+            for i in range(0, len(baskets) - args.batch_size + 1, args.batch_size)]
+
+async def client(host, port, path, payloads, offset, counter, n_requests, latencies, errors):
+    """
+    One keep-alive connection sending requests back to back until n_requests
+    have been sent in total (over all clients).
+    """
+    reader, writer = await asyncio.open_connection(host, port)
+    i = offset
+    try:
+        while counter[0] < n_requests:
+            counter[0] += 1
+            body = payloads[i % len(payloads)]
+            i += 1
+            request = (f"POST {path} HTTP/1.1\r\nHost: {host}\r\nContent-Type: application/json\r\n"
+                       f"Content-Length: {len(body)}\r\n\r\n").encode() + body
+            start = time.perf_counter()
+            writer.write(request)
+            await writer.drain()
+            head = await reader.readuntil(b"\r\n\r\n")
+            status_line, *header_lines = head.decode("latin-1").split("\r\n")
+            length = 0
+            for line in header_lines:
+                name, _, value = line.partition(":")
+                if name.strip().lower() == "content-length":
+                    length = int(value)
+            await reader.readexactly(length)
+            latencies.append(time.perf_counter() - start)
+            if status_line.split(" ")[1] != "200":
+                errors.append(status_line)
+    finally:
+        writer.close()
+
+async def run_load(args, payloads):
+    url = urlsplit(args.url)
+    host, port = url.hostname, url.port or 80
+    path = f"/{args.endpoint}"
+
+    if args.warmup:
+        await asyncio.gather(*(client(host, port, path, payloads, c, [0], args.warmup // args.concurrency, [], [])
+                               for c in range(args.concurrency)))
+
+    counter, latencies, errors = [0], [], []
+    start = time.perf_counter()
+    await asyncio.gather(*(client(host, port, path, payloads, c * 7919, counter, args.requests, latencies, errors)
+                           for c in range(args.concurrency)))
+    return time.perf_counter() - start, np.array(latencies), errors
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test a running recommendation server (scripts/serve.py).")
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--endpoint", choices=["recommend", "segment"], default="recommend")
+    parser.add_argument("--requests", type=int, default=5000, help="Measured requests in total")
+    parser.add_argument("--concurrency", type=int, default=16, help="Concurrent keep-alive connections")
+    parser.add_argument("--warmup", type=int, default=500, help="Unmeasured requests sent first")
+    parser.add_argument("--batch-size", type=int, default=1, help="Baskets (or RFM rows) per request")
+    parser.add_argument("--basket-size", type=int, default=3, help="Items per basket")
+    parser.add_argument("--distinct", type=int, default=10_000,
+                        help="Distinct baskets (or RFM rows) to cycle through; fewer means more cache hits")
+    parser.add_argument("--rules", default=os.path.join("artifacts", "association_rules"),
+                        help="Rules artifact whose items are sampled for the baskets")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the results as JSON")
+    args = parser.parse_args()
+
+    payloads = make_payloads(args, np.random.default_rng(args.seed))
+    seconds, latencies, errors = asyncio.run(run_load(args, payloads))
+    latency_ms = latencies * 1000 if len(latencies) else np.zeros(1)
+    results = {
+        'endpoint': args.endpoint, 'requests': len(latencies), 'errors': len(errors),
+        'concurrency': args.concurrency, 'batch_size': args.batch_size, 'seconds': seconds,
+        'requests_per_s': len(latencies) / seconds, 'baskets_per_s': len(latencies) * args.batch_size / seconds,
+        'mean_ms': float(latency_ms.mean()),
+        'p50_ms': float(np.percentile(latency_ms, 50)),
+        'p90_ms': float(np.percentile(latency_ms, 90)),
+        'p99_ms': float(np.percentile(latency_ms, 99)),
+        'max_ms': float(latency_ms.max()),
+    }
+
+    print(f"{results['requests']} requests to /{args.endpoint} in {seconds:.2f}s "
+          f"({args.concurrency} connections, {args.batch_size} per request, {results['errors']} errors)")
+    unit = "rows" if args.endpoint == "segment" else "baskets"
+    print(f"Throughput: {results['requests_per_s']:,.0f} requests/s ({results['baskets_per_s']:,.0f} {unit}/s)")
+    print(f"Latency: p50 {results['p50_ms']:.2f} ms, p90 {results['p90_ms']:.2f} ms, "
+          f"p99 {results['p99_ms']:.2f} ms, max {results['max_ms']:.2f} ms")
+    if errors:
+        print(f"First error: {errors[0]}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}")
+
+if __name__ == "__main__":
+    main()
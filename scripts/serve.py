@@ -0,0 +1,34 @@
+import argparse
+import asyncio
+import os
+import sys
+
+# Add project root to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from core.pipeline import load_config
+from core.server import RecommendationServer
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve recommendations and segments over HTTP from the trained artifacts.")
+    parser.add_argument("--config", help="Training config (JSON) whose artifacts_dir/serving_dir to serve")
+    parser.add_argument("--set", dest="overrides", action="append", default=[], metavar="KEY=VALUE",
+                        help="Override one setting, e.g. --set artifacts_dir=artifacts (repeatable)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=2, help="Worker processes (0 = one thread in the server process)")
+    parser.add_argument("--chunk-size", type=int, default=256, help="Baskets per worker task in batched requests")
+    parser.add_argument("--top-n", type=int, default=5)
+    parser.add_argument("--cache-size", type=int, default=10_000, help="Cached baskets per worker")
+    args = parser.parse_args()
+
+    config = load_config(args.config, args.overrides)
+    server = RecommendationServer(config['artifacts_dir'], config['serving_dir'], workers=args.workers,
+                                  chunk_size=args.chunk_size, top_n=args.top_n, cache_size=args.cache_size)
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        print("Server stopped")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,30 @@
+import argparse
+import os
+import sys
+
+# Add project root to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from core.data_processing import load_cached_dataset
+from core.rfm_model import calculate_rfm, sweep_kmeans, RFM_INPUT_COLUMNS
+
+def main():
+    parser = argparse.ArgumentParser(description="Sweep the number of KMeans clusters on the RFM features.")
+    parser.add_argument("data", help="Path to the raw transactions CSV")
+    parser.add_argument("--k-min", type=int, default=2)
+    parser.add_argument("--k-max", type=int, default=10)
+    parser.add_argument("--mode", choices=["full", "minibatch"], default="minibatch")
+    parser.add_argument("--sample-size", type=int, default=10000, help="Customers sampled for the silhouette score")
+    parser.add_argument("--n-jobs", type=int, default=None)
+    args = parser.parse_args()
+
+    print("Running RFM analysis...")
+    rfm = calculate_rfm(load_cached_dataset(args.data, columns=RFM_INPUT_COLUMNS))
+    print(f"Sweeping k={args.k_min}..{args.k_max} over {len(rfm)} customers...")
+    results, best_k = sweep_kmeans(rfm, range(args.k_min, args.k_max + 1), mode=args.mode,
+                                   sample_size=args.sample_size, n_jobs=args.n_jobs)
+    print(results.to_string(index=False))
+    print(f"Best k by silhouette: {best_k}")
+
+if __name__ == "__main__":
+    main()
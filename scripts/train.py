@@ -1,43 +1,45 @@
-import pandas as pd
+import argparse
+import json
 import os
 import sys
 
 # Add project root to path
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from core.data_processing import load_and_clean_data
-from core.rfm_model import calculate_rfm, train_kmeans, save_model
-from core.recommendation import generate_rules, save_rules
-import os
-import joblib
+from core.pipeline import load_config, run_pipeline, STAGES
 
 def main():
-    print("Loading data...")
-    df = load_and_clean_data(r"d:/data/data/data.csv")
-    print(f"Data loaded. Shape: {df.shape}")
-    
-    print("Running RFM analysis...")
-    rfm = calculate_rfm(df)
-    print("Training KMeans...")
-    rfm_labeled, kmeans, scaler, segment_map = train_kmeans(rfm)
-    
-    print("Saving RFM artifacts...")
-    save_model(kmeans, "kmeans_model.pkl")
-    save_model(scaler, "scaler.pkl")
-    
-    rfm_labeled.to_csv("d:/data/artifacts/rfm_segments.csv", index=False)
-    print("RFM segments saved.")
+    parser = argparse.ArgumentParser(description="Train the RFM segmentation and association rule artifacts.")
+    parser.add_argument("--config", help="JSON file overriding core.pipeline.DEFAULT_CONFIG")
+    parser.add_argument("--set", dest="overrides", action="append", default=[], metavar="KEY=VALUE",
+                        help="Override one setting, e.g. --set rules.min_support=0.01 (repeatable)")
+    parser.add_argument("--data", help="Path to the raw transactions CSV (same as --set data=...)")
+    parser.add_argument("--jobs", type=int, default=None, help="Worker processes for independent stages (1 = serial)")
+    parser.add_argument("--force", nargs="*", default=[], choices=[s.name for s in STAGES] + ["all"],
+                        help="Re-run these stages even if their inputs are unchanged")
+    parser.add_argument("--report", default=None,
+                        help="Where to write the JSON run report (default: <work_dir>/run_report.json)")
+    parser.add_argument("--profile-stage", help="Span to capture in detail, e.g. rules or fpgrowth")
+    parser.add_argument("--profile-mode", choices=["cprofile", "tracemalloc"], default="cprofile")
+    parser.add_argument("--print-config", action="store_true", help="Print the effective config and exit")
+    args = parser.parse_args()
+
+    config = load_config(args.config, args.overrides)
+    if args.data:
+        config['data'] = args.data
+    if args.print_config:
+        print(json.dumps(config, indent=2))
+        return
 
-    all_products = sorted(df['description'].unique().astype(str))
-    joblib.dump(all_products, "d:/data/artifacts/unique_products.pkl")
-    print(f"Unique products saved: {len(all_products)}")
+    report_path = args.report or os.path.join(config['work_dir'], "run_report.json")
+    status = run_pipeline(config, n_jobs=args.jobs, force=args.force, profile_stage=args.profile_stage,
+                          profile_mode=args.profile_mode, report_path=report_path)
 
-    print("Generating association rules...")
-    rules = generate_rules(df, min_support=0.005, min_threshold=0.2) 
-    
-    print(f"Rules generated: {len(rules)}")
-    save_rules(rules, "association_rules.pkl")
-    print("Optimization complete.")
+    for name, info in status.items():
+        counters = info.get('report', {}).get('totals', {})
+        details = ", ".join(f"{k}={v:,}" for k, v in counters.items())
+        print(f"{name:>10}: {info['status']:<6} {info['seconds']:8.2f}s  {details}")
+    print(f"Run report written to {report_path}")
 
 if __name__ == "__main__":
     main()
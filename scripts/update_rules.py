@@ -0,0 +1,52 @@
+import argparse
+import os
+import sys
+import time
+
+# Add project root to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from core.data_processing import load_and_clean_data
+from core.recommendation import generate_rules, compact_rules, save_rules
+from core.pipeline import load_config
+
+def main():
+    parser = argparse.ArgumentParser(description="Merge new invoices into the saved itemset state and rewrite the association rules.")
+    parser.add_argument("data", help="CSV with the new invoices (already ingested invoices are skipped)")
+    parser.add_argument("--config", help="Training config (JSON) the rules were built with")
+    parser.add_argument("--set", dest="overrides", action="append", default=[], metavar="KEY=VALUE",
+                        help="Override one setting, e.g. --set compact.top_k=5 (repeatable)")
+    parser.add_argument("--state", help="Itemset state (default: the config's rules.state_path)")
+    parser.add_argument("--min-support", type=float, help="Default: the config's rules.min_support")
+    parser.add_argument("--min-threshold", type=float, help="Default: the config's rules.min_threshold")
+    args = parser.parse_args()
+
+    config = load_config(args.config, args.overrides)
+    params = config['rules']
+    state = args.state or params['state_path']
+    min_support = params['min_support'] if args.min_support is None else args.min_support
+    min_threshold = params['min_threshold'] if args.min_threshold is None else args.min_threshold
+
+    print("Loading new invoices...")
+    df = load_and_clean_data(args.data)
+
+    print("Updating itemset counts...")
+    start = time.perf_counter()
+    stats = {}
+    rules = generate_rules(df, min_support=min_support, min_threshold=min_threshold,
+                           state_path=state, incremental=True, stats=stats)
+    print(f"Merged {stats['n_new_invoices']} new invoices into {stats['n_invoices']} "
+          f"({stats['n_rescanned_itemsets']} candidates counted against history) "
+          f"in {time.perf_counter() - start:.1f}s")
+
+    print(f"Rules generated: {len(rules)}")
+    # Same compaction as the pipeline's compact stage, so the served rule set stays compacted
+    compact = config['compact']
+    rules = compact_rules(rules, min_lift=compact['min_lift'], top_k=compact['top_k'],
+                          drop_redundant=compact['drop_redundant'])
+    print(f"Rules after compaction: {len(rules)}")
+    save_rules(rules, "association_rules.pkl", save_dir=config['artifacts_dir'])
+    print("Update complete.")
+
+if __name__ == "__main__":
+    main()
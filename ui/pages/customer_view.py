@@ -8,37 +8,59 @@ import sys
 # Add parent directory to path to import core modules
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
 
-import importlib
-import core.recommendation
-importlib.reload(core.recommendation)
-from core.recommendation import recommend_for_basket
+from core.recommendation import RecommendationService, RuleIndex
+from core.catalog import ProductCatalog
 
+ARTIFACTS_DIR = r"d:/data/artifacts"
+
+# Loaded once per server process and shared by every session and rerun
+@st.cache_resource(show_spinner=False)
 def load_resources():
-    rules_path = r"d:/data/artifacts/association_rules.pkl"
-    if not os.path.exists(rules_path):
-        st.error("Resource files not found. Please ensure training is complete.")
+    rules_dir = os.path.join(ARTIFACTS_DIR, "association_rules")
+    rules_path = os.path.join(ARTIFACTS_DIR, "association_rules.pkl")
+    if os.path.exists(rules_dir):
+        rule_index = RuleIndex.load(rules_dir)
+    elif os.path.exists(rules_path):
+        rule_index = RuleIndex(joblib.load(rules_path))
+    else:
         return None, None
     
-    rules = joblib.load(rules_path)
-    
-    products_path = r"d:/data/artifacts/unique_products.pkl"
-    if os.path.exists(products_path):
-        items = joblib.load(products_path)
+    # Typeahead index built at training time; older artifacts fall back to the plain product list
+    catalog_dir = os.path.join(ARTIFACTS_DIR, "product_catalog")
+    products_path = os.path.join(ARTIFACTS_DIR, "unique_products.pkl")
+    if os.path.exists(catalog_dir):
+        catalog = ProductCatalog.load(catalog_dir)
+    elif os.path.exists(products_path):
+        catalog = ProductCatalog.from_products(joblib.load(products_path))
     else:
-        items = sorted(list(set(rules['antecedents'].explode()) | set(rules['consequents'].explode())))
+        catalog = ProductCatalog.from_products(rule_index.items)
         
-    return rules, items
+    return rule_index, catalog
+
+# One service (and cache) for all sessions: repeat baskets are answered from memory
+@st.cache_resource(show_spinner=False)
+def load_service(_rule_index):
+    return RecommendationService(_rule_index, top_n=4)
 
 st.title("Shopping Assistant")
 st.caption("Personalized product recommendations powered by association rule mining.")
 
-rules, product_list = load_resources()
+rule_index, catalog = load_resources()
 
-if rules is not None:
+if rule_index is None:
+    st.error("Resource files not found. Please ensure training is complete.")
+else:
     # Sidebar Selection
     with st.sidebar:
         st.header("Your Basket")
-        selected_items = st.multiselect("Search Products", product_list, placeholder="Type to search items...")
+        # Only the current matches (plus the basket) are sent to the browser
+        if 'basket' not in st.session_state:
+            st.session_state.basket = []
+        query = st.text_input("Search Products", placeholder="Type to search items...")
+        matches = catalog.search(query, limit=25) if query else catalog.popular(25)
+        options = st.session_state.basket + [m for m in matches if m not in st.session_state.basket]
+        selected_items = st.multiselect("Matching Products", options, default=st.session_state.basket)
+        st.session_state.basket = selected_items
         
         st.divider()
         if selected_items:
@@ -58,9 +80,8 @@ if rules is not None:
         st.divider()
         st.subheader("Recommended Additions")
         
-        # Strip items to ensure matching logic handles potential trailing spaces from data
-        stripped_selection = [item.strip() for item in selected_items]
-        recommendations = recommend_for_basket(stripped_selection, rules, top_n=4)
+        # Catalog keys are already normalized (Upper and Strip), as the rule index expects
+        recommendations = load_service(rule_index).recommend(catalog.normalize(selected_items), normalized=True)
         
         if recommendations:
             rec_cols = st.columns(4)
@@ -87,7 +108,7 @@ if rules is not None:
 
     with st.expander("Technical Details (Association Rules)"):
         # Formatting for readability
-        display_rules = rules.copy()
+        display_rules = rule_index.to_frame(limit=10)
         for col in ['antecedents', 'consequents']:
             display_rules[col] = display_rules[col].apply(lambda x: list(x))
-        st.dataframe(display_rules.head(10), use_container_width=True)
+        st.dataframe(display_rules, use_container_width=True)
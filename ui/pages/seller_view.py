@@ -1,6 +1,7 @@
 
 import streamlit as st
 import pandas as pd
+import numpy as np
 import plotly.express as px
 import os
 import sys
@@ -8,27 +9,41 @@ import sys
 # Add parent directory to path
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
 
+from core.rfm_model import load_segments
+from core.analytics import SegmentStore
+
+ARTIFACTS_DIR = r"d:/data/artifacts"
+
+# Loaded once per server process and shared by every session and rerun.
+# The store is built at training time; older artifacts are indexed on first load.
+@st.cache_resource(show_spinner=False)
 def load_data():
-    rfm_path = r"d:/data/artifacts/rfm_segments.csv"
+    store_dir = os.path.join(ARTIFACTS_DIR, "segment_store")
+    if os.path.exists(store_dir):
+        return SegmentStore.load(store_dir)
+    segments_dir = os.path.join(ARTIFACTS_DIR, "rfm_segments")
+    if os.path.exists(segments_dir):
+        return SegmentStore.build(load_segments(segments_dir))
+    rfm_path = os.path.join(ARTIFACTS_DIR, "rfm_segments.csv")
     if not os.path.exists(rfm_path):
         return None
     df = pd.read_csv(rfm_path)
     df['customerid'] = df['customerid'].astype(int)
-    return df
+    return SegmentStore.build(df)
 
 st.title("Business Intelligence")
 st.caption("Strategic analysis of customer segments and purchasing behaviors.")
 
-rfm_df = load_data()
+store = load_data()
 
-if rfm_df is not None:
+if store is not None:
     # Key Performance Indicators
     st.markdown("#### Performance Summary")
     k1, k2, k3, k4 = st.columns(4)
-    k1.metric("Customer Base", f"{len(rfm_df):,}")
-    k2.metric("Average CLV", f"£{rfm_df['monetary'].mean():.0f}")
-    k3.metric("Purchase Frequency", f"{rfm_df['frequency'].mean():.1f}")
-    k4.metric("Market Segments", f"{rfm_df['segment'].nunique()}")
+    k1.metric("Customer Base", f"{store.kpis['customers']:,}")
+    k2.metric("Average CLV", f"£{store.kpis['mean_monetary']:.0f}")
+    k3.metric("Purchase Frequency", f"{store.kpis['mean_frequency']:.1f}")
+    k4.metric("Market Segments", f"{store.kpis['segments']}")
     
     st.divider()
     
@@ -37,9 +52,10 @@ if rfm_df is not None:
     
     with col1:
         st.markdown("#### Customer Segmentation (RFM)")
+        # One point per occupied recency x monetary cell, sized by its customer count
         fig = px.scatter(
-            rfm_df, x='recency', y='monetary', color='segment',
-            size='monetary', hover_name='customerid',
+            store.density_frame(), x='recency', y='monetary', color='segment',
+            size='customers', hover_data={'customers': True},
             log_y=True, template="plotly_white",
             color_discrete_sequence=px.colors.qualitative.Prism
         )
@@ -48,9 +64,8 @@ if rfm_df is not None:
         
     with col2:
         st.markdown("#### Segment Distribution")
-        seg_counts = rfm_df['segment'].value_counts().reset_index()
-        seg_counts.columns = ['segment', 'count']
-        fig_pie = px.pie(seg_counts, values='count', names='segment', hole=0.5, 
+        seg_counts = store.summary[store.summary['customers'] > 0]
+        fig_pie = px.pie(seg_counts, values='customers', names='segment', hole=0.5, 
                          color_discrete_sequence=px.colors.qualitative.Prism)
         fig_pie.update_layout(showlegend=False, margin=dict(l=0, r=0, t=0, b=0))
         st.plotly_chart(fig_pie, use_container_width=True)
@@ -65,18 +80,17 @@ if rfm_df is not None:
         st.markdown("Analyze individual customer profiles for tailored engagement strategies.")
         search_id = st.text_input("Enter Customer ID", placeholder="e.g., 17850")
         
-        if not rfm_df.empty:
-            sample_ids = rfm_df['customerid'].sample(min(3, len(rfm_df))).tolist()
+        if len(store):
+            sample_ids = np.random.choice(store.sample_ids, min(3, len(store.sample_ids)), replace=False).tolist()
             st.caption(f"Reference IDs: {', '.join(map(str, sample_ids))}")
 
     with col_res:
         if search_id:
             try:
                 cust_int = int(float(search_id))
-                cust_data = rfm_df[rfm_df['customerid'] == cust_int]
+                c = store.lookup(cust_int)
                 
-                if not cust_data.empty:
-                    c = cust_data.iloc[0]
+                if c is not None:
                     with st.container(border=True):
                         st.markdown(f"**Customer Profile: #{cust_int}**")
                         st.markdown(f"Segment: **{c['segment']}**")